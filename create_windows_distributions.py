@@ -1,49 +1,103 @@
 """This file builds windows distributions, zip files with GladTeX and all other
 files."""
+import collections
+import concurrent.futures
+import functools
 import os
+import re
+import shlex
 import shutil
 import stat
+import subprocess
 import sys
+import time
 import zipfile
 import gleetex
 
+# use a faster, API-compatible DEFLATE implementation if one is installed; this
+# is also used by zipfile itself
+try:
+    from isal import isal_zlib as zlib
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as zlib
+    except ImportError:
+        import zlib
+if zipfile.zlib is not zlib:
+    zipfile.zlib = zlib
+    zipfile.crc32 = zlib.crc32
+
+# files larger than this are not read into memory, but streamed into the
+# archive
+STREAMING_THRESHOLD = 8 << 20
+
+# these files are compressed already, compressing them again costs time for
+# hardly any gain
+STORE_EXTENSIONS = frozenset(('.zip', '.pyd', '.dll', '.png', '.jpg', '.gz'))
+
+_VER_RE = re.compile(r'(\d+\.\d+\.\d+)')
+
+README_FIRST = (
+    'GladTeX for Windows\r\n===================\r\n\r\n'
+    'This program has been compiled with python %s. If you want to embedd it in binary form with your binary python application, the version numbers HAVE TO match.\r\n'
+    '\r\nFor more information, see the file README.md or http://humenda.github.io/GladTeX\r\n'
+)
+# documentation bundled with each release; files without an extension get a
+# .txt extension within the archive
+DOC_FILES = (
+    ('README.md', 'README.md'),
+    ('COPYING', 'COPYING.txt'),
+    ('ChangeLog', 'ChangeLog.txt'),
+)
+
 
 def exec_setup_py(arg_string):
     """Execute `python setup.py` as a subprocess.
 
     Use Wine, if necessary.
     """
-    ret = None
     if sys.platform.startswith('win'):
-        ret = os.system('python setup.py ' + arg_string)
+        cmd = [sys.executable]
     else:
         if not shutil.which('wine'):
             print('Error: Wine is not installed, aborting…')
             sys.exit(5)
-        ret = os.system('wine python setup.py ' + arg_string)
-    if ret:
-        if sys.platform.startswith('win'):
-            print('Aborting at command `python setup.py %s`.' % arg_string)
-        else:
-            print('Aborting at command `wine python setup.py %s`.' % arg_string)
+        cmd = ['wine', 'python']
+    cmd += ['setup.py'] + shlex.split(arg_string)
+    if subprocess.run(cmd).returncode:
+        print('Aborting at command `%s`.' % ' '.join(cmd))
         sys.exit(7)
 
 
+def start_wine_server():
+    """Start a persistent Wine server, shared by all following Wine processes.
+
+    Otherwise each `wine` invocation starts (and shuts down) its own server.
+    Wine's debug output is silenced, unless configured otherwise.
+    """
+    os.environ.setdefault('WINEDEBUG', '-all')
+    if shutil.which('wineserver'):
+        # returns immediately, the server detaches itself; it exits 60 s
+        # after the last Wine process terminated
+        subprocess.call(['wineserver', '--persistent=60'])
+
+
+@functools.lru_cache(maxsize=1)
 def get_python_version():
-    """Return the python version as a string."""
-    import re
-    import subprocess
+    """Return the python version as a string.
 
-    args = ['python', '--version']
-    if not sys.platform.startswith('win'):
-        args = ['wine'] + args
-    proc = subprocess.Popen(args, stdout=subprocess.PIPE)
+    On Windows, this is the running interpreter, which is also used for the
+    build. Otherwise, Wine Python is queried and the result is cached.
+    """
+    if sys.platform.startswith('win'):
+        return '%d.%d.%d' % sys.version_info[:3]
+    proc = subprocess.Popen(['wine', 'python', '--version'], stdout=subprocess.PIPE)
     stdout = proc.communicate()[0].decode(sys.getdefaultencoding())
     if proc.wait():
         raise TypeError(
             'Abnormal subprocess termination while querying python version.'
         )
-    return re.search(r'.*?(\d+\.\d+\.\d+)', stdout).groups()[0]
+    return _VER_RE.search(stdout).group(1)
 
 
 def get_executable_name(label):
@@ -55,38 +109,144 @@ def get_executable_name(label):
     )
 
 
-def bundle_files(src, output_name):
-    """Bundle the compiled binary files with README, ChangeLog and COPYING."""
-    if os.path.exists(output_name):
-        shutil.rmtree(output_name)
-    os.rename(src, output_name)
-    # add README.first
-    with open(os.path.join(output_name, 'README.first.txt'), 'w') as f:
-        f.write('GladTeX for Windows\r\n===================\r\n\r\n')
-        f.write(
-            'This program has been compiled with python 3.4.4. If you want to embedd it in binary form with your binary python application, the version numbers HAVE TO match.\r\n'
+def scale_compresslevel(compresslevel):
+    """Translate a zlib compression level (0-9) into the range of the DEFLATE
+    implementation in use. isal only knows the levels 0 (fastest) to 3 (best),
+    so e.g. 6 becomes 2; for zlib and zlib-ng, the level is unchanged. None or
+    a negative level select the default level."""
+    if compresslevel is None or compresslevel < 0:
+        return zlib.Z_DEFAULT_COMPRESSION
+    return round(min(compresslevel, 9) * zlib.Z_BEST_COMPRESSION / 9)
+
+
+def read_file(path):
+    """Return the contents of the given file. Run in a thread pool, so that
+    the files are read while others are compressed."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def iter_files(root):
+    """Recursively yield a tuple (path, stat_result) for each file below
+    `root`.
+
+    The stat information is cached by `os.scandir`, so that each file is only
+    queried once.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_files(entry.path)
+            else:
+                yield entry.path, entry.stat()
+
+
+def should_store(path):
+    """Return whether `path` should be stored uncompressed in an archive."""
+    return os.path.splitext(path)[1].lower() in STORE_EXTENSIONS
+
+
+def make_zip_info(arcname, st):
+    """Create a ZipInfo for `arcname` from an existing stat_result, without
+    querying the file system again (as `ZipInfo.from_file` would do)."""
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+    zinfo.compress_type = (
+        zipfile.ZIP_STORED if should_store(arcname) else zipfile.ZIP_DEFLATED
+    )
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+def bundle_files(src, output_name, compresslevel=None):
+    """Bundle the compiled binary files with README, ChangeLog and COPYING.
+
+    The files from `src` are added to `output_name`.zip, below a directory
+    called `output_name`; `src` is removed afterwards.
+    `compresslevel` is a zlib compression level from 0 to 9, the default level
+    of the used zlib implementation is used if omitted. If isal is used, which
+    only supports the levels 0 to 3, the level is scaled to that range (see
+    scale_compresslevel), so the same levels work with every implementation."""
+    compresslevel = scale_compresslevel(compresslevel)
+    with zipfile.ZipFile(
+        output_name + '.zip', 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel
+    ) as z:
+        # add README.first
+        z.writestr(
+            output_name + '/README.first.txt', README_FIRST % get_python_version()
         )
-        f.write(
-            '\r\nFor more information, see the file README.md or http://humenda.github.io/GladTeX\r\n'
+        # add README and other files
+        for file, dest in DOC_FILES:
+            z.write(file, output_name + '/' + dest)
+
+        def write(path, zinfo, job):
+            if job:
+                z.writestr(zinfo, job.result(), compresslevel=compresslevel)
+            else:  # written in chunks, using the archive's compression level
+                z.write(path, zinfo.filename, zinfo.compress_type)
+
+        # read files in parallel while the tree is traversed, but compress and
+        # write them sequentially (and in order) to the archive; only a window
+        # of jobs is kept, so that not all files are held in memory
+        workers = os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+            for path, st in iter_files(src):
+                arcname = os.path.join(output_name, os.path.relpath(path, src))
+                zinfo = make_zip_info(arcname, st)
+                # large and uncompressed files are streamed, see below
+                job = None
+                if (
+                    zinfo.compress_type == zipfile.ZIP_DEFLATED
+                    and st.st_size <= STREAMING_THRESHOLD
+                ):
+                    job = executor.submit(read_file, path)
+                pending.append((path, zinfo, job))
+                # write finished files right away, wait if the window is full
+                while pending and (
+                    len(pending) > 2 * workers
+                    or not pending[0][2]
+                    or pending[0][2].done()
+                ):
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+    shutil.rmtree(src)
+
+
+def clone_tree(src, dst):
+    """Copy the directory tree `src` to `dst`, which must not exist yet.
+
+    Copy-on-write clones are used where the platform and the file system
+    support them, so that no file data has to be duplicated. Otherwise, a
+    plain copy is made; hard links are not an option, since the build
+    modifies files and permissions within the copy.
+    """
+    ret = 1
+    if sys.platform.startswith('linux') and shutil.which('cp'):
+        ret = subprocess.call(
+            ['cp', '-a', '--reflink=always', src, dst], stderr=subprocess.DEVNULL
         )
+    elif sys.platform == 'darwin':
+        import ctypes
 
-    # copy README and other files
-    for file in ['README.md', 'COPYING', 'ChangeLog']:
-        dest = os.path.join(output_name, file)
-        # check whether file ending exists
-        if not '.' in dest[-5:]:
-            dest += '.txt'
-        shutil.copy(file, dest)
-
-    files = [
-        os.path.join(root, file)
-        for root, _, files in os.walk(output_name)
-        for file in files
-    ]
-    with zipfile.ZipFile(output_name + '.zip', 'w', zipfile.ZIP_DEFLATED) as z:
-        for file in files:
-            z.write(file)
-    shutil.rmtree(output_name)
+        libc = ctypes.CDLL('/usr/lib/libc.dylib', use_errno=True)
+        ret = libc.clonefile(os.fsencode(src), os.fsencode(dst), 0)
+    elif sys.platform.startswith('win') and shutil.which('robocopy'):
+        # multi-threaded copy without per-file output; robocopy signals
+        # success with exit codes below 8
+        ret = (
+            subprocess.call(
+                ['robocopy', src, dst, '/E', '/MT:16']
+                + ['/NFL', '/NDL', '/NJH', '/NJS', '/NC', '/NS']
+            )
+            > 7
+        )
+    if not ret:
+        return
+    if os.path.exists(dst):  # remove partial clone
+        shutil.rmtree(dst, ignore_errors=True)
+    shutil.copytree(src, dst)
 
 
 class TemporaryBuildDirectory:
@@ -106,7 +266,7 @@ class TemporaryBuildDirectory:
 
     def __enter__(self):
         self.tmpdir = self.get_temp_directory()
-        shutil.copytree(os.getcwd(), self.tmpdir)
+        clone_tree(os.getcwd(), self.tmpdir)
         os.chdir(self.tmpdir)
         return self
 
@@ -138,7 +298,10 @@ class TemporaryBuildDirectory:
             import tempfile
 
             tmp_base = tempfile.gettempdir()
-        tmpdir = os.path.join(tmp_base, 'gladtex.build')
+        # builds may run concurrently, so use one directory per output file
+        tmpdir = os.path.join(
+            tmp_base, os.path.splitext(self.output_file_name)[0] + '.build'
+        )
         if os.path.exists(tmpdir):
             shutil.rmtree(tmpdir, onerror=self.__onerror)
         return tmpdir
@@ -158,14 +321,31 @@ class TemporaryBuildDirectory:
             raise exc_info
 
 
+def build(output_file_name, setup_args):
+    """Build GladTeX with the given arguments for `setup.py` in a temporary
+    directory and bundle the result to `output_file_name`."""
+    with TemporaryBuildDirectory(output_file_name) as tb:
+        exec_setup_py(setup_args)
+        bundle_files('dist', os.path.splitext(tb.output_file_name)[0])
+
+
 if __name__ == '__main__':
-    with TemporaryBuildDirectory(get_executable_name('embeddable')) as tb:
+    if not sys.platform.startswith('win'):
+        start_wine_server()
+    builds = [
         # build embeddable release, where all files are separate DLL's; if somebody
         # distributes a python app, these DLL files can be shared
-        exec_setup_py('py2exe -c -O 2 -i gleetex --bundle-files 3')
-        bundle_files('dist', os.path.splitext(tb.output_file_name)[0])
-
-    # create a stand-alone version of GladTeX
-    with TemporaryBuildDirectory(get_executable_name('standalone')) as tb:
-        exec_setup_py('py2exe -i gleetex -c -O 2 --bundle-files 1')
-        bundle_files('dist', os.path.splitext(tb.output_file_name)[0])
+        (
+            get_executable_name('embeddable'),
+            'py2exe -c -O 2 -i gleetex --bundle-files 3',
+        ),
+        # create a stand-alone version of GladTeX
+        (
+            get_executable_name('standalone'),
+            'py2exe -i gleetex -c -O 2 --bundle-files 1',
+        ),
+    ]
+    # the builds are independent of each other, so run them in parallel
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(builds)) as executor:
+        for job in [executor.submit(build, *args) for args in builds]:
+            job.result()
@@ -22,19 +22,19 @@ def transform_ast(ast):
     conv = gleetex.cachedconverter.CachedConverter('.', True, encoding='UTF-8')
     # automatically handle unicode
     conv.set_replace_nonascii(True)
-    # go parallel
-    conv.convert_all('.', formulas)
+    # convert all formulas at once, this runs the LaTeX and dvipng/dvisvgm
+    # processes concurrently
+    conv.convert_all(formulas)
 
     # an converted image has information like image depth and height, adjust
     # data structure for write-back
     formulas = [conv.get_data_for(eqn, style) for _p, style, eqn in formulas]
     # get a formatter instance
-    with gleetex.htmlhandling.HtmlImageFormatter('.') as img_fmt:
-        # non-ascii sequences will be replaced in the laternative text
-        img_fmt.set_replace_nonascii(True)
-        # this alters the AST reference, so no return value required
-        gleetex.pandoc.replace_formulas_in_ast(
-            img_fmt, ast['blocks'], formulas)
+    img_fmt = gleetex.htmlhandling.HtmlImageFormatter('.')
+    # non-ascii sequences will be replaced in the laternative text
+    img_fmt.set_replace_nonascii(True)
+    # this alters the AST reference, so no return value required
+    gleetex.pandoc.replace_formulas_in_ast(img_fmt, ast['blocks'], formulas)
 
 
 def cleanup(path):
@@ -1,20 +1,14 @@
 # (c) 2013-2021 Sebastian Humenda
 # This code is licenced under the terms of the LGPL-3+, see the file COPYING for
 # more details.
-from . import caching
-from . import cachedconverter
-from . import htmlhandling
-from . import image
-from . import pandoc
-from . import parser
-from . import sink
-from . import typesetting
+import importlib
 
 VERSION = '3.1.0'
 
 __all__ = [
     'caching',
     'cachedconverter',
+    'globalcache',
     'htmlhandling',
     'image',
     'pandoc',
@@ -24,3 +18,18 @@ __all__ = [
     'unicode',
     'VERSION',
 ]
+
+# submodules are imported on first access, so that e.g. the command line
+# interface only loads what it actually needs
+_SUBMODULES = frozenset(__all__) - {'VERSION'}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        # the import binds the module as attribute of this package
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
@@ -2,35 +2,313 @@
 # This code is licenced under the terms of the LGPL-3+, see the file COPYING for
 # more details.
 import argparse
+import functools
+import mmap
 import multiprocessing
 import os
 import shlex
-import posixpath
+import stat
+import string
 import sys
-import textwrap
-
-from . import (
-    caching,
-    cachedconverter,
-    htmlhandling,
-    pandoc,
-    parser,
-    sink,
-    typesetting,
-    VERSION,
+
+# only import what is required for parsing the command line, the remaining
+# modules are imported on demand after the arguments were validated
+from . import sink, VERSION
+
+_HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+_ASCII_LETTERS = frozenset(string.ascii_letters)
+# (option destination, command line flag) of all colour options
+COLOR_OPTIONS = (('background_color', '-b'), ('foreground_color', '-c'))
+
+# command line options which are passed on to the CachedConverter
+CONVERTER_OPTIONS = (
+    'preamble',
+    'latex_maths_env',
+    'png',
+    'keep_latex_source',
+    'foreground_color',
+    'background_color',
+    'is_epub',
 )
 
+# (part of a LaTeX error message, hint to show to the user) for common errors
+LATEX_ERROR_HINTS = (
+    (
+        'Package inputenc',
+        'Add the switch `-R` to automatically replace unicode '
+        'characters with LaTeX command sequences.',
+    ),
+)
+
+
+def is_color(value):
+    """Return whether `value` is a colour, given either as a six-digit hex
+    number or as dvips colour name."""
+    if len(value) == 6 and _HEX_DIGITS.issuperset(value):
+        return True
+    return bool(value) and _ASCII_LETTERS.issuperset(value)
+
+
+def read_text(path, encoding):
+    """Read the file at `path` and decode it with the given encoding.
+
+    Regular files are mapped into memory and decoded without copying them
+    into an intermediate bytes object first. Line endings are translated
+    to \\n, as for files opened in text mode.
+    """
+    with open(path, 'rb') as file:
+        status = os.fstat(file.fileno())
+        # empty files and pipes cannot be mapped
+        if status.st_size and stat.S_ISREG(status.st_mode):
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                text = str(mapped, encoding)
+        else:
+            text = str(file.read(), encoding)
+    return translate_newlines(text)
+
+
+def translate_newlines(text):
+    """Translate \\r\\n and \\r line endings to \\n, as done for files opened in
+    text mode."""
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
 
 class HelpfulCmdParser(argparse.ArgumentParser):
     """This variant of arg parser always prints the full help whenever an error
     occurs."""
 
+    def format_help(self):
+        # description and epilog are only needed for the help, so only set
+        # them when the help is actually formatted
+        self.description = (
+            'GladTeX is a preprocessor that enables the use of LaTeX'
+            ' maths within HTML files. The maths, embedded in <EQ>...</EQ> '
+            'tags, as if within \\(..\\) in LaTeX (or $...$ in TeX), is fed '
+            'through latex and replaced by images.\n\nPlease also see the '
+            'documentation on the web or from the manual page for more '
+            'information, especially on environment variables.'
+        )
+        self.epilog = 'GladTeX %s, http://humenda.github.io/GladTeX' % VERSION
+        return super().format_help()
+
     def error(self, message):
         sys.stderr.write('error: %s\n' % message)
         self.print_help()
         sys.exit(2)
 
 
+@functools.lru_cache(maxsize=None)
+def _build_parser():
+    """Create the command line parser; it is built only once and reused for
+    all further invocations."""
+    cmd = HelpfulCmdParser()
+    cmd.add_argument(
+        '-a',
+        default=sink.EXCLUSION_FILE_NAME,
+        dest='exclusionfile',
+        help=(
+            'path to the file to which to write excluded formulas '
+            'for images which are too long for the alt attribute into a '
+            'single separate file and link images to it'
+        ),
+    )
+    cmd.add_argument(
+        '-b',
+        dest='background_color',
+        help=(
+            'Set background color for resulting images '
+            '(default transparent, use hex)'
+        ),
+    )
+    cmd.add_argument(
+        '-c',
+        dest='foreground_color',
+        help=('Set foreground color for resulting images (default ' '000000, hex)'),
+    )
+    cmd.add_argument(
+        '--cache-max-entries',
+        metavar='COUNT',
+        dest='cache_max_entries',
+        type=int,
+        default=None,
+        help='Keep at most COUNT formulas in the cache, removing the least '
+        'recently used ones and their images (default: no limit)',
+    )
+    cmd.add_argument(
+        '-d',
+        default='',
+        dest='img_directory',
+        help=(
+            'Directory in which to'
+            ' store generated images in (relative to the output file)'
+        ),
+    )
+    cmd.add_argument(
+        '-e',
+        dest='latex_maths_env',
+        help=(
+            'Set custom maths environment to surround the formula'
+            ' (e.g. flalign)'
+        ),
+    )
+    cmd.add_argument(
+        '-f',
+        metavar='SIZE',
+        dest='fontsize',
+        type=int,
+        default=12,
+        help='Set font size in pt (default 12)',
+    )
+    cmd.add_argument(
+        '-E',
+        dest='encoding',
+        default=None,
+        help='Overwrite encoding to use (default UTF-8)',
+    )
+    cmd.add_argument(
+        '--epub',
+        dest='is_epub',
+        default=False,
+        action='store_true',
+        help='Optimise output for epub, for instance round height/width of '
+        'images',
+    )
+    cmd.add_argument(
+        '--global-cache',
+        action='store_true',
+        dest='global_cache',
+        help='Share converted formulas between documents through a cache in '
+        '$XDG_CACHE_HOME/gladtex (default ~/.cache/gladtex)',
+    )
+    cmd.add_argument(
+        '-i',
+        metavar='CLASS',
+        dest='inlinemath',
+        help="CSS class to assign to inline math (default: 'inlinemath')",
+    )
+    cmd.add_argument(
+        '-l',
+        metavar='CLASS',
+        dest='displaymath',
+        help="CSS class to assign to block-level math (default: 'displaymath')",
+    )
+    cmd.add_argument(
+        '-j',
+        '--jobs',
+        metavar='JOBS',
+        dest='jobs',
+        type=int,
+        default=None,
+        help='Number of formulas to convert in parallel (default: twice '
+        'the number of CPUs)',
+    )
+    cmd.add_argument(
+        '-K',
+        dest='keep_latex_source',
+        action='store_true',
+        default=False,
+        help='keep LaTeX file(s) when converting formulas (useful for debugging)',
+    )
+    cmd.add_argument(
+        '-m',
+        dest='machinereadable',
+        action='store_true',
+        default=False,
+        help='Print output in machine-readable format (less concise, better parseable)',
+    )
+    cmd.add_argument(
+        '-n',
+        action='store_true',
+        dest='notkeepoldcache',
+        help=(
+            'Purge unreadable caches along with all eqn*.png files. '
+            'Caches can be unreadable if the used GladTeX version is '
+            'incompatible. If this option is unset, GladTeX will '
+            'simply fail when the cache is unreadable.'
+        ),
+    )
+    cmd.add_argument(
+        '--no-cache',
+        action='store_true',
+        dest='no_cache',
+        help='Neither read nor write the formula cache, convert all '
+        'formulas',
+    )
+    cmd.add_argument(
+        '-o',
+        metavar='FILENAME',
+        dest='output',
+        help=(
+            "Set output file name; '-' will print text to stdout (by"
+            'default input file name is used and .htex extension changed '
+            'to .html)'
+        ),
+    )
+    cmd.add_argument(
+        '-p',
+        metavar='LATEX_STATEMENT',
+        dest='preamble',
+        help=(
+            'Add given LaTeX code to the preamble of the LaTeX '
+            'document that is used to generate the embedded images. '
+            'In order to add the contents of a file to the preamble, '
+            'use `-p "\\input{FILE}"`.'
+        ),
+    )
+    cmd.add_argument(
+        '-P',
+        dest='pandocfilter',
+        action='store_true',
+        help='Use GladTeX as a Pandoc filter: read a Pandoc JSON AST '
+        'from stdin, convert the images, change math blocks to '
+        'images and write JSON to stdout; '
+        'see the man page on how to pass args to GladTeX in this mode',
+    )
+    cmd.add_argument(
+        '--png',
+        action='store_true',
+        dest='png',
+        help='Use PNG instead of SVG for images',
+    )
+    cmd.add_argument(
+        '-r',
+        '--resolution',
+        metavar='DPI',
+        dest='dpi',
+        default=None,
+        help=(
+            'Set resolution in DPI, only available if PNG output '
+            'selected; also see `-f`'
+        ),
+    )
+    cmd.add_argument(
+        '-R',
+        action='store_true',
+        dest='replace_nonascii',
+        default=False,
+        help='Replace non-ascii characters in formulas '
+        'through their LaTeX commands',
+    )
+    cmd.add_argument(
+        '-u',
+        metavar='URL',
+        dest='url',
+        help='URL to image files (relative links are default)',
+    )
+    cmd.add_argument(
+        'input',
+        nargs='?',
+        default='-',
+        help=(
+            'Input .htex file with LaTeX '
+            'formulas (if omitted or -, stdin will be read)'
+        ),
+    )
+    return cmd
+
+
 class Main:
     """This class parses command line arguments and deals with the conversion.
 
@@ -42,182 +320,15 @@ class Main:
 
     def _parse_args(self, args):
         """Parse command line arguments and return option instance."""
-        epilog = 'GladTeX %s, http://humenda.github.io/GladTeX' % VERSION
-        description = (
-            'GladTeX is a preprocessor that enables the use of LaTeX'
-            ' maths within HTML files. The maths, embedded in <EQ>...</EQ> '
-            'tags, as if within \\(..\\) in LaTeX (or $...$ in TeX), is fed '
-            'through latex and replaced by images.\n\nPlease also see the '
-            'documentation on the web or from the manual page for more '
-            'information, especially on environment variables.'
-        )
-        cmd = HelpfulCmdParser(epilog=epilog, description=description)
-        cmd.add_argument(
-            '-a',
-            default=sink.EXCLUSION_FILE_NAME,
-            dest='exclusionfile',
-            help='path to the file to which to write excluded formulas'
-            + 'for images which are too long for the alt attribute into a '
-            + 'single separate file and link images to it',
-        )
-        cmd.add_argument(
-            '-b',
-            dest='background_color',
-            help=(
-                'Set background color for resulting images '
-                '(default transparent, use hex)'
-            ),
-        )
-        cmd.add_argument(
-            '-c',
-            dest='foreground_color',
-            help=('Set foreground color for resulting images (default ' '000000, hex)'),
-        )
-        cmd.add_argument(
-            '-d',
-            default='',
-            dest='img_directory',
-            help='Directory in which to'
-            + ' store generated images in (relative to the output file)',
-        )
-        cmd.add_argument(
-            '-e',
-            dest='latex_maths_env',
-            help='Set custom maths environment to surround the formula'
-            + ' (e.g. flalign)',
-        )
-        cmd.add_argument(
-            '-f',
-            metavar='SIZE',
-            dest='fontsize',
-            default=12,
-            help='Set font size in pt (default 12)',
-        )
-        cmd.add_argument(
-            '-E',
-            dest='encoding',
-            default=None,
-            help='Overwrite encoding to use (default UTF-8)',
-        )
-        cmd.add_argument(
-            '--epub',
-            dest='is_epub',
-            default=False,
-            action='store_true',
-            help='Optimise output for epub, for instance round height/width of '
-            'images',
-        )
-        cmd.add_argument(
-            '-i',
-            metavar='CLASS',
-            dest='inlinemath',
-            help="CSS class to assign to inline math (default: 'inlinemath')",
-        )
-        cmd.add_argument(
-            '-l',
-            metavar='CLASS',
-            dest='displaymath',
-            help="CSS class to assign to block-level math (default: 'displaymath')",
-        )
-        cmd.add_argument(
-            '-K',
-            dest='keep_latex_source',
-            action='store_true',
-            default=False,
-            help='keep LaTeX file(s) when converting formulas (useful for debugging)',
-        )
-        cmd.add_argument(
-            '-m',
-            dest='machinereadable',
-            action='store_true',
-            default=False,
-            help='Print output in machine-readable format (less concise, better parseable)',
-        )
-        cmd.add_argument(
-            '-n',
-            action='store_true',
-            dest='notkeepoldcache',
-            help=(
-                'Purge unreadable caches along with all eqn*.png files. '
-                'Caches can be unreadable if the used GladTeX version is '
-                'incompatible. If this option is unset, GladTeX will '
-                'simply fail when the cache is unreadable.'
-            ),
-        )
-        cmd.add_argument(
-            '-o',
-            metavar='FILENAME',
-            dest='output',
-            help=(
-                "Set output file name; '-' will print text to stdout (by"
-                'default input file name is used and .htex extension changed '
-                'to .html)'
-            ),
-        )
-        cmd.add_argument(
-            '-p',
-            metavar='LATEX_STATEMENT',
-            dest='preamble',
-            help='Add given LaTeX code to the preamble of the LaTeX '
-            + 'document that is used to generate the embedded images. '
-            + 'In order to add the contents of a file to the preamble, '
-            + 'use `-p "\\input{FILE}"`.',
-        )
-        cmd.add_argument(
-            '-P',
-            dest='pandocfilter',
-            action='store_true',
-            help='Use GladTeX as a Pandoc filter: read a Pandoc JSON AST '
-            'from stdin, convert the images, change math blocks to '
-            'images and write JSON to stdout; '
-            'see the man page on how to pass args to GladTeX in this mode',
-        )
-        cmd.add_argument(
-            '--png',
-            action='store_true',
-            dest='png',
-            help='Use PNG instead of SVG for images',
-        )
-        cmd.add_argument(
-            '-r',
-            '--resolution',
-            metavar='DPI',
-            dest='dpi',
-            default=None,
-            help=(
-                'Set resolution in DPI, only available if PNG output '
-                'selected; also see `-f`'
-            ),
-        )
-        cmd.add_argument(
-            '-R',
-            action='store_true',
-            dest='replace_nonascii',
-            default=False,
-            help='Replace non-ascii characters in formulas '
-            'through their LaTeX commands',
-        )
-        cmd.add_argument(
-            '-u',
-            metavar='URL',
-            dest='url',
-            help='URL to image files (relative links are default)',
-        )
-        cmd.add_argument(
-            'input',
-            help='Input .htex file with LaTeX '
-            + 'formulas (if omitted or -, stdin will be read)',
-        )
-        return cmd.parse_args(args)
+        return _build_parser().parse_args(args)
 
     def exit(self, text, status):
         """Exit function.
 
         Could be used to register any clean up action.
         """
-        sys.stderr.write(text)
-        if not text.endswith('\n'):
-            sys.stderr.write('\n')
+        # a single write: stderr is unbuffered
+        sys.stderr.write(text if text.endswith('\n') else text + '\n')
         sys.exit(status)
 
     def validate_options(self, opts):
@@ -227,11 +338,23 @@ class Main:
         gave an invalid parameter.
         """
         if opts.fontsize and opts.dpi:
-            print("Options -f and -d can't be used at the same time.")
-            sys.exit(14)
+            self.exit("Options -f and -d can't be used at the same time.", 14)
         if opts.dpi and not opts.png:
-            print(('Impossible to set resolution when using SVG as output, ' 'try -f'))
-            sys.exit(14)
+            self.exit(
+                'Impossible to set resolution when using SVG as output, try -f', 14
+            )
+        if opts.jobs is not None and opts.jobs < 1:
+            self.exit('The number of jobs must be at least 1.', 14)
+        if opts.cache_max_entries is not None and opts.cache_max_entries < 1:
+            self.exit('The maximum number of cache entries must be at least 1.', 14)
+        for attr, flag in COLOR_OPTIONS:
+            color = getattr(opts, attr)
+            if color and not is_color(color):
+                self.exit(
+                    'Invalid colour %s for %s, expected a hex number like '
+                    '00ff00 or a dvips colour name.' % (color, flag),
+                    14,
+                )
 
     def get_input_output(self, options):
         """Determine whether GladTeX is reading from stdin/file, writing to
@@ -244,19 +367,30 @@ class Main:
         latter if encoding is unknown.
         """
         data = None
-        output = '-'
+        # if encoding was specified or if a pandoc filter is supplied, read
+        # document with that encoding
+        encoding = 'UTF-8' if options.pandocfilter else options.encoding
         if options.input == '-':
-            data = sys.stdin.read()
+            try:
+                if encoding:  # one read from the binary stream, decoded once
+                    data = translate_newlines(str(sys.stdin.buffer.read(), encoding))
+                else:
+                    data = sys.stdin.read()
+            except UnicodeDecodeError as e:
+                self.exit(
+                    (
+                        f'Error while reading from stdin: {e}\nProbably the '
+                        'input has a different encoding, try specifying -E.'
+                    ),
+                    88,
+                )
         else:
             try:
-                # if encoding was specified or if a pandoc filter is supplied,
-                # read document with default encoding
-                if options.encoding or options.pandocfilter:
-                    encoding = 'UTF-8' if options.pandocfilter else options.encoding
-                    with open(options.input, encoding=encoding) as f:
-                        data = f.read()
+                if encoding:
+                    data = read_text(options.input, encoding)
                 else:  # read as binary and guess from HTML meta charset
-                    with open(options.input, 'rb') as file:
+                    # unbuffered: the file is read in one go, sized via fstat
+                    with open(options.input, 'rb', buffering=0) as file:
                         data = file.read()
             except UnicodeDecodeError as e:
                 self.exit(
@@ -272,24 +406,32 @@ class Main:
                 self.exit(f'Error: file {options.input} not found.', 20)
 
         # check which output file name to use
-        base_path = ''
-        if options.output:
-            base_path = os.path.dirname(options.output)
-        elif options.input != '-':
-            output = os.path.splitext(options.input)[0] + '.html'
-            base_path = os.path.dirname(options.input)
-
-        if base_path:  # if finally a basepath found:, strip \\ if on Windows
-            base_path = posixpath.join(*(base_path.split('\\')))
+        output = options.output
+        if not output:
+            output = (
+                '-'
+                if options.input == '-'
+                else os.path.splitext(options.input)[0] + '.html'
+            )
+        base_path = '' if output == '-' else os.path.dirname(output)
+        # if finally a basepath found, replace \\ by / if on Windows; on other
+        # systems, \\ is a valid character within file names
+        if os.sep == '\\' and base_path:
+            base_path = base_path.replace('\\', '/')
         # the basepath needs to be relative to the output file
         return (data, base_path, output)
 
     def run(self, args):
         options = self._parse_args(args[1:])
         self.validate_options(options)
+        from . import htmlhandling, parser
+
         self.__encoding = options.encoding
         fmt = 'pandocfilter' if options.pandocfilter else 'html'
         doc, base_path, output = self.get_input_output(options)
+        if not options.pandocfilter and not htmlhandling.contains_formulas(doc):
+            self.write_unchanged(doc, output)
+            return
         try:
             # doc is either a list of raw HTML chunks and formulas or a tuple of
             # (document AST, list of formulas) if options.pandocfilter
@@ -319,32 +461,57 @@ class Main:
         # formulas that were too long to write them out later
         with (
             sys.stdout if output == '-' else open(
-                output, 'w', encoding=self.__encoding)
+                output, 'w', encoding=self.__encoding, buffering=1 << 20)
         ) as file:
             if options.pandocfilter:
+                from . import pandoc
+
                 pandoc.write_pandoc_ast(file, processed, img_fmt)
             else:
                 htmlhandling.write_html(file, processed, img_fmt)
+        excluded = img_fmt.get_excluded()
+        if not excluded:  # don't create an empty exclusion file
+            return
         # ToDo: make sink type an argument
         sink_type = sink.SinkType.html_file
         try:
-            sink.EXCLUSION_FORMULA_SINKS[sink_type](
-                img_fmt.get_exclusion_file_path(), img_fmt.get_excluded())
+            write_excluded = sink.EXCLUSION_FORMULA_SINKS[sink_type]
         except KeyError:
             raise NotImplementedError() from None
+        write_excluded(img_fmt.get_exclusion_file_path(), excluded)
+
+    def write_unchanged(self, document, output):
+        """Write a document without formulas to the output. Bytes are written
+        as they are, strings are encoded like a converted document."""
+        if isinstance(document, bytes):
+            if output == '-':
+                sys.stdout.flush()
+                sys.stdout.buffer.write(document)
+                sys.stdout.buffer.flush()
+            else:
+                with open(output, 'wb') as file:
+                    file.write(document)
+        elif output == '-':
+            sys.stdout.write(document)
+        else:
+            # parsed strings are written as UTF-8 as well, see run()
+            with open(output, 'w', encoding='utf-8') as file:
+                file.write(document)
 
     def convert_images(self, parsed_document, base_path, img_dir, options):
         """Convert all formulas to images and store file path and equation in a
         list to be processed later on."""
+        from . import caching, cachedconverter
+
         base_path = '' if not base_path or base_path == '.' else base_path
         img_dir = '' if not img_dir or img_dir == '.' else img_dir
-        result = []
         try:
             conv = cachedconverter.CachedConverter(
                 base_path,
                 not options.notkeepoldcache,
                 encoding=self.__encoding,
                 img_dir=img_dir,
+                use_cache=not options.no_cache,
             )
         except caching.JsonParserException as e:
             self.exit(e.args[0], 78)
@@ -353,66 +520,72 @@ class Main:
         if options.pandocfilter:
             formulas = parsed_document[1]
         else:  # HTML chunks from EqnParser
-            formulas = [
-                c for c in parsed_document if isinstance(c, (tuple, list))]
+            # output of EqnParser: list-alike is formula, str is raw HTML; the
+            # formulas are replaced in-place after the conversion
+            result = list(parsed_document)
+            formula_indices = [
+                i for i, chunk in enumerate(result) if isinstance(chunk, (tuple, list))
+            ]
+            formulas = [result[i] for i in formula_indices]
+        # only pass the first occurrence of each formula to the converter
+        first_occurrences = {}
+        for i, (_p, displaymath, formula) in enumerate(formulas):
+            first_occurrences.setdefault((formula, displaymath), i)
+        indices = list(first_occurrences.values())
         try:
-            conv.convert_all(formulas)
+            # cached formulas are skipped, only the others are typeset
+            conv.convert_all([formulas[i] for i in indices])
         except cachedconverter.ConversionException as e:
+            # report the number of the formula within the whole document
+            e.formula_count = indices[e.formula_count - 1] + 1
             self.emit_latex_error(
                 e, options.machinereadable, options.replace_nonascii)
 
+        # look up each distinct formula once, recurring formulas share the data
+        converted = {}
+        for formula, displaymath in first_occurrences:
+            data = conv.lookup(formula, displaymath)
+            if data is None:
+                raise KeyError(
+                    (
+                        "formula '{}' not found; that means it was "
+                        'not converted which should usually not happen.'
+                    ).format(formula)
+                )
+            converted[formula, displaymath] = data
         if options.pandocfilter:
             # return (ast, formulas), just with formulas being replaced with the
             # conversion data
             return (
                 parsed_document[0],
-                [conv.get_data_for(eqn, style) for _p, style, eqn in formulas],
+                [converted[eqn, style] for _p, style, eqn in formulas],
             )
-        for chunk in parsed_document:
-            # output of EqnParser: list-alike is formula, str is raw HTML
-            if isinstance(chunk, (tuple, list)):
-                _p, displaymath, formula = chunk
-                try:
-                    result.append(conv.get_data_for(formula, displaymath))
-                except KeyError as e:
-                    # formula is usually tuple(str, bool)
-                    formula = e.args[0]
-                    if isinstance(formula, (list, tuple)):
-                        formula = e.args[0][0]  # ignore bool(displaymath)
-                    raise KeyError(
-                        (
-                            "formula '{}' not found; that means it was "
-                            'not converted which should usually not happen.'
-                        ).format(formula)
-                    ) from e
-            else:
-                result.append(chunk)
+        for i, (_p, displaymath, formula) in zip(formula_indices, formulas):
+            result[i] = converted[formula, displaymath]
         return result
 
     def set_options(self, conv, options):
         """Apply options from command line parser to the converter."""
-        # set options
-        options_to_query = [
-            'preamble',
-            'latex_maths_env',
-            'png',
-            'keep_latex_source',
-            'foreground_color',
-            'background_color',
-            'is_epub',
-        ]
-        for option_str in options_to_query:
-            option = getattr(options, option_str)
-            if option:
-                if option in ('True', 'False', 'false', 'true'):
-                    option = bool(option)
-                conv.set_option(option_str, option)
+        values = vars(options)
+        # boolean switches are store_true flags, so values arrive typed
+        overrides = {
+            name: values[name] for name in CONVERTER_OPTIONS if values[name]
+        }
         if options.dpi:
-            conv.set_option('dpi', float(options.dpi))
+            overrides['dpi'] = float(options.dpi)
         elif options.fontsize:
-            conv.set_option('fontsize', options.fontsize)
+            overrides['fontsize'] = options.fontsize
+        conv.update_options(overrides)
         if options.replace_nonascii:
             conv.set_replace_nonascii(True)
+        if options.jobs:
+            conv.set_thread_count(options.jobs)
+        if options.cache_max_entries:
+            conv.set_max_cache_entries(options.cache_max_entries)
+        if options.global_cache:
+            from . import globalcache
+
+            conv.set_global_cache(globalcache.default_directory())
 
     def emit_latex_error(self, err, machine_readable, escape):
         """Format a LaTeX error in a meaningful way.
@@ -425,57 +598,46 @@ class Main:
             raise err
         escaped = err.formula
         if escape:
+            from . import typesetting
+
             escaped = typesetting.escape_unicode_maths(err.formula)
-        msg = None
-        additional = ''
-        if 'Package inputenc' in err.args[0]:
-            additional += (
-                'Add the switch `-R` to automatically replace unicode '
-                'characters with LaTeX command sequences.'
-            )
+        additional = next(
+            (hint for marker, hint in LATEX_ERROR_HINTS if marker in err.args[0]), ''
+        )
+        is_escaped = escaped != err.formula
+        has_position = err.src_line_number and err.src_pos_on_line
         if machine_readable:
-            msg = 'Number: {}\nFormula: {}{}\nMessage: {}'.format(
-                err.formula_count,
-                err.formula,
-                (
-                    ''
-                    if escaped == err.formula
-                    else '\nLaTeXified formula: %s' % escaped
-                ),
-                err.cause,
+            lines = []
+            if has_position:
+                lines.append(f'Line: {err.src_line_number}, {err.src_pos_on_line}')
+            lines.append(f'Number: {err.formula_count}')
+            lines.append(f'Formula: {err.formula}')
+            if is_escaped:
+                lines.append(f'LaTeXified formula: {escaped}')
+            lines.append(
+                f'Message: {err.cause}; {additional}' if additional
+                else f'Message: {err.cause}'
             )
-            if err.src_line_number and err.src_pos_on_line:
-                msg = ('Line: {}, {}\n' + msg).format(
-                    err.src_line_number, err.src_pos_on_line
-                )
-            if additional:
-                msg += '; ' + additional
         else:
-            formula = '    ' + err.formula.replace('\n', '\n    ')
-            escaped = (
-                '    ' + escaped.replace('\n', '\n    ')
-                if escaped != err.formula
-                else ''
-            )
-            msg = 'Error while converting formula %d' % err.formula_count
-            if err.src_line_number and err.src_pos_on_line:
-                msg = msg.rstrip() + ' at line %d, %d:\n' % (
-                    err.src_line_number,
-                    err.src_pos_on_line,
-                )
-            msg += '%s%s\n%s' % (
-                formula,
-                (
-                    ''
-                    if not escaped or escaped == err.formula
-                    else '\nFormula without unicode symbols:\n%s' % escaped
-                ),
-                err.cause,
+            indent = lambda text: '    ' + text.replace('\n', '\n    ')
+            position = (
+                f' at line {err.src_line_number}, {err.src_pos_on_line}'
+                if has_position else ''
             )
+            lines = [
+                f'Error while converting formula {err.formula_count}{position}:',
+                indent(err.formula),
+            ]
+            if is_escaped:
+                lines += ['Formula without unicode symbols:', indent(escaped)]
             if additional:
+                import textwrap
 
-                msg += ' undefined.\n' + \
-                    '\n'.join(textwrap.wrap(additional, 80))
+                lines.append(err.cause + ' undefined.')
+                lines += textwrap.wrap(additional, 80)
+            else:
+                lines.append(err.cause)
+        msg = '\n'.join(lines)
         self.exit(msg, 91)
 
 
@@ -11,9 +11,11 @@ conversion if the formula image is already present."""
 import concurrent.futures
 import multiprocessing
 import os
+import shutil
 import subprocess
+import sys
 
-from . import caching, image, typesetting
+from . import caching, globalcache, image, typesetting
 from .caching import normalize_formula
 from .image import Format
 
@@ -80,18 +82,30 @@ class CachedConverter:
     :param img_dir directory for images (default ., equivalent to base_path)
             For example "images" would put it in `base_path`/images and "../img"
             would put it in "base_path/../img"
+    :param use_cache If False, the cache is neither read from nor written to
+            disk, all formulas are converted (default True); the images are
+            then named in the order of the formulas, overwriting those of a
+            previous run
     """
 
     GLADTEX_CACHE_FILE_NAME = 'gladtex.cache'
+    # maximum number of formulas typeset by a single LaTeX run
+    MAX_BATCH_SIZE = 50
 
-    def __init__(self, base_path, keep_old_cache=True, encoding=None, img_dir=''):
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self, base_path, keep_old_cache=True, encoding=None, img_dir='', use_cache=True
+    ):
         empty_path = lambda p: ('' if not p or p.strip(os.sep) == '.' else p)
         self.__output_path = empty_path(base_path) # path for converted document
         self.__img_dir = empty_path(img_dir)  # relative to base_path
         # cache path is **relative** to base_path
-        cache_path = os.path.join(
-            self.__img_dir, CachedConverter.GLADTEX_CACHE_FILE_NAME
-        )
+        cache_path = None
+        self.__use_cache = use_cache
+        if use_cache:
+            cache_path = os.path.join(
+                self.__img_dir, CachedConverter.GLADTEX_CACHE_FILE_NAME
+            )
         self.__is_epub = False
         self.__cache = caching.ImageCache(
             cache_path,
@@ -113,6 +127,9 @@ class CachedConverter:
         }
         self.__encoding = encoding
         self.__replace_nonascii = False
+        self.__thread_count = None
+        self.__global_cache = None
+        self.__cache.set_options(self._get_cache_options())
 
     def set_option(self, option, value):
         """Set one of the options accepted for gleetex.image.Tex2img.
@@ -126,6 +143,18 @@ class CachedConverter:
                 'Option must be one of ' + ', '.join(self.__options.keys())
             )
         self.__options[option] = value
+        # images created with other options are not reused
+        self.__cache.set_options(self._get_cache_options())
+
+    def update_options(self, options):
+        """Set several options at once; `options` is a dictionary mapping
+        option names, as accepted by set_option, to their values."""
+        if not options.keys() <= self.__options.keys():
+            raise ValueError(
+                'Option must be one of ' + ', '.join(self.__options.keys())
+            )
+        self.__options.update(options)
+        self.__cache.set_options(self._get_cache_options())
 
     def set_replace_nonascii(self, flag):
         """If set, GladTeX will convert all non-ascii character to LaTeX
@@ -134,6 +163,35 @@ class CachedConverter:
         This setting is passed through to typesetting.LaTeXDocument.
         """
         self.__replace_nonascii = flag
+        self.__cache.set_options(self._get_cache_options())
+
+    def set_thread_count(self, count):
+        """Set the number of formulas converted in parallel.
+
+        By default, twice the number of CPUs is used.
+        """
+        if count < 1:
+            raise ValueError('thread count must be at least 1, got %s' % count)
+        self.__thread_count = count
+
+    def set_max_cache_entries(self, count):
+        """Limit the number of formulas kept in the cache; see
+        caching.ImageCache.set_max_entries."""
+        self.__cache.set_max_entries(count)
+
+    def set_global_cache(self, directory):
+        """Share converted images with other documents through a
+        globalcache.GlobalCache in the given directory. Formulas found there
+        are copied instead of being converted."""
+        self.__global_cache = globalcache.GlobalCache(directory)
+
+    def _disable_global_cache(self, error):
+        """Warn about a failed access to the global cache and stop using it;
+        the formulas are still converted into the image directory."""
+        sys.stderr.write(
+            'Warning: disabling the global cache after an error: %s\n' % error
+        )
+        self.__global_cache = None
 
     def convert_all(self, formulas):
         """convert_all(formulas) Convert all formulas using self.convert
@@ -144,6 +202,8 @@ class CachedConverter:
         converted.
         """
         formulas_to_convert = self._get_formulas_to_convert(formulas)
+        if formulas_to_convert and self.__global_cache:
+            formulas_to_convert = self._copy_from_global_cache(formulas_to_convert)
         if formulas_to_convert:
             self.__converter = image.Tex2img(
                 Format.Png if self.__options['png'] else Format.Svg
@@ -159,39 +219,92 @@ class CachedConverter:
                     getattr(self.__converter, 'set_' + option)(value)
             self._convert_concurrently(formulas_to_convert)
 
+    def _get_cache_options(self):
+        """Return all options which influence the resulting images."""
+        options = {
+            key: value
+            for key, value in self.__options.items()
+            if key != 'keep_latex_source'
+        }
+        options['encoding'] = self.__encoding
+        options['replace_nonascii'] = self.__replace_nonascii
+        return options
+
     def _get_formulas_to_convert(self, formulas):
         """Build up a pipeline (list) of formulas for conversion.
         Formulas that that are in the cache or are doubled in the pipeline are dropped."""
         pipeline = []  # find as many file names as equations
         file_ext = Format.Png.value if self.__options['png'] else Format.Svg.value
-        eqn_path = lambda x: os.path.join(self.__img_dir, 'eqn%03d.%s' % (x, file_ext))
+        # list the image directory once instead of probing each file name
+        imgdir_full = os.path.join(self.__output_path, self.__img_dir)
+        # existing images are never overwritten, even without a cache: they
+        # might belong to other documents sharing the image directory
+        try:
+            with os.scandir(imgdir_full or '.') as entries:
+                taken_names = {entry.name for entry in entries}
+        except FileNotFoundError:
+            taken_names = set()  # created on conversion
 
-        # is (formula, display_math) already in the list of formulas to convert;
+        # (formula, display_math) already in the list of formulas to convert;
         # displaymath is important since formulas look different in inline maths
-        formula_was_converted = lambda f, dsp: \
-                (normalize_formula(f), dsp) in ( (normalize_formula(u[0]), u[3]) for u in pipeline)
+        queued = set()
         # find enough free file names
         file_name_count = 0
-        used_file_names = []  # track which file names have been assigned
         for formula_count, (pos, dsp, formula) in enumerate(formulas):
+            key = (normalize_formula(formula), dsp)
             # ToDo: this belongs in the cache
-            if not self.__cache.contains(formula, dsp) and not formula_was_converted(
-                formula, dsp
-            ):
-                while (
-                    os.path.exists(eqn_path(file_name_count))
-                    or eqn_path(file_name_count) in used_file_names
-                ):
+            if key not in queued and not self.__cache.contains(formula, dsp):
+                queued.add(key)
+                file_name = 'eqn%03d.%s' % (file_name_count, file_ext)
+                while file_name in taken_names:
                     file_name_count += 1
-                used_file_names.append(eqn_path(file_name_count))
+                    file_name = 'eqn%03d.%s' % (file_name_count, file_ext)
+                taken_names.add(file_name)
                 pipeline.append(
-                    (formula, pos, eqn_path(file_name_count), dsp, formula_count + 1)
+                    (
+                        formula,
+                        pos,
+                        os.path.join(self.__img_dir, file_name),
+                        dsp,
+                        formula_count + 1,
+                    )
                 )
         return pipeline
 
+    def _copy_from_global_cache(self, formulas_to_convert):
+        """Copy the images of all formulas present in the global cache into
+        the image directory and add them to the cache. The formulas which
+        still need to be converted are returned."""
+        options = self._get_cache_options()
+        remaining = []
+        for entry in formulas_to_convert:
+            formula, _pos, img_path, dsp, _count = entry
+            if not self.__global_cache:  # disabled after an error
+                remaining.append(entry)
+                continue
+            try:
+                found = self.__global_cache.lookup(formula, dsp, options)
+                if found:
+                    cached_image, pos = found
+                    destination = os.path.join(self.__output_path, img_path)
+                    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+                    shutil.copyfile(cached_image, destination)
+            except OSError as e:
+                self._disable_global_cache(e)
+                found = None
+            if not found:
+                remaining.append(entry)
+                continue
+            self.__cache.add_formula(formula, pos, img_path, dsp)
+        if len(remaining) < len(formulas_to_convert):
+            self.__cache.write()
+        return remaining
+
     def _convert_concurrently(self, formulas_to_convert):
         """The actual concurrent conversion process.
 
+        The formulas are split into batches, each batch is typeset by a
+        single LaTeX run and the batches are converted concurrently.
         Method is intended to be called from convert_all().
         """
         imgdir_full = os.path.join(self.__output_path, self.__img_dir)
@@ -200,75 +313,96 @@ class CachedConverter:
             # formulacreation step
             os.makedirs(imgdir_full)
 
-        thread_count = int(multiprocessing.cpu_count() * 2)
+        thread_count = self.__thread_count or int(multiprocessing.cpu_count() * 2)
+        # a kept LaTeX source is only useful if there's one per formula
+        batch_size = 1
+        if not self.__options['keep_latex_source']:
+            batch_size = min(
+                CachedConverter.MAX_BATCH_SIZE,
+                -(-len(formulas_to_convert) // thread_count),  # ceil
+            )
+        batches = [
+            formulas_to_convert[start : start + batch_size]
+            for start in range(0, len(formulas_to_convert), batch_size)
+        ]
+        options = self._get_cache_options()
         # convert missing formulas
         with concurrent.futures.ThreadPoolExecutor(
             max_workers=thread_count
         ) as executor:
-            # start conversion and mark each thread with its formula, position
-            # in the source file and formula_count (index into a global list of
-            # formulas)
-            jobs = {
-                executor.submit(self.__convert, eqn, path, dsp): (eqn, pos, count)
-                for (eqn, pos, path, dsp, count) in formulas_to_convert
-            }
+            jobs = [executor.submit(self._convert_batch, batch) for batch in batches]
             error_occurred = None
             for future in concurrent.futures.as_completed(jobs):
                 # cancel all pending requests
                 if error_occurred and not future.done():
                     future.cancel()
                     continue
-                formula, pos_in_src, formula_count = jobs[future]
-                error_occurred = self._handle_job_output(future, formula, pos_in_src, formula_count)
+                converted, error = future.result()
+                for data in converted:
+                    self.__cache.add_formula(
+                        data['formula'], data['pos'], data['path'], data['displaymath']
+                    )
+                    if self.__global_cache:
+                        try:
+                            self.__global_cache.store(
+                                data['formula'],
+                                data['displaymath'],
+                                options,
+                                os.path.join(self.__output_path, data['path']),
+                                data['pos'],
+                            )
+                        except OSError as e:
+                            self._disable_global_cache(e)
+                self.__cache.write()  # write back cache with valid entries
+                error_occurred = error_occurred or error
         # pylint: disable=raising-bad-type
         if error_occurred:
             raise error_occurred
 
-    def _handle_job_output(self, future, formula, pos_in_src, formula_count):
-        """Process the output as produced by each conversion future.
-        Handle the error case by signalling the error to end all other
-        conversions."""
-        try:
-            data = future.result()
-        except subprocess.SubprocessError as e:
-            # retrieve the position (line, pos on line) in the source document
-            # from original formula list
-            if pos_in_src:  # missing for the pandocfilter case
-                pos_in_src = [p + 1 for p in pos_in_src] # line/pos count from 1
-            self.__cache.write()  # write back cache with valid entries
-            if pos_in_src:  # pandocfilter case:
-                return ConversionException(
-                    str(e.args[0]),
-                    formula,
-                    formula_count,
-                    pos_in_src[0],
-                    pos_in_src[1],
-                )
-            else:
-                return ConversionException(
-                    str(e.args[0]), formula, formula_count
+    def _convert_batch(self, batch):
+        """Convert a batch of formulas with a single LaTeX run.
+
+        If this fails, the formulas are converted one by one to find the
+        culprit. Returned is a tuple with a list of the conversion results
+        and a ConversionException, if a formula couldn't be converted.
+        """
+        if len(batch) > 1:
+            try:
+                return (self.__convert_all_at_once(batch), None)
+            except (subprocess.SubprocessError, ValueError, OSError):
+                # also raised on a timeout: convert formula by formula, for a
+                # precise error
+                pass
+        converted = []
+        for formula, pos_in_src, img_path, dsp, formula_count in batch:
+            try:
+                converted.append(self.__convert(formula, img_path, dsp))
+            except subprocess.SubprocessError as e:
+                return (
+                    converted,
+                    self._get_conversion_error(e, formula, pos_in_src, formula_count),
                 )
-        else:
-            self.__cache.add_formula(
-                formula, data['pos'], data['path'], data['displaymath']
+        return (converted, None)
+
+    def _get_conversion_error(self, error, formula, pos_in_src, formula_count):
+        """Create a ConversionException from the subprocess error raised
+        during conversion of the given formula."""
+        # retrieve the position (line, pos on line) in the source document
+        # from original formula list
+        if pos_in_src:  # missing for the pandocfilter case
+            pos_in_src = [p + 1 for p in pos_in_src] # line/pos count from 1
+            return ConversionException(
+                str(error.args[0]),
+                formula,
+                formula_count,
+                pos_in_src[0],
+                pos_in_src[1],
             )
-            self.__cache.write()
+        return ConversionException(str(error.args[0]), formula, formula_count)
 
-    def __convert(self, formula, img_path, displaymath=False):
-        """convert(formula, img_path, displaymath=False) Convert given formula
-        with displaymath/inlinemath. This method wraps the formula in a tex
-        document, executes all the steps to produce a image and return the
-        positioning information for the HTML output. It does not check the
-        cache.
-
-        :param formula formula to convert
-        :param img_path image output path (relative to the configured base_path,
-                    see __init__)
-        :param displaymath whether or not to use displaymath during the conversion
-        :return dictionary with position (pos), image path (path) and formula
-            style (displaymath, boolean) as a dictionary with the keys in
-            parenthesis
-        """
+    def __create_document(self, formula, displaymath):
+        """Create a LaTeX document for the given formula, with all configured
+        options applied."""
         latex = typesetting.LaTeXDocument(formula)
         latex.set_displaymath(displaymath)
 
@@ -288,22 +422,67 @@ class CachedConverter:
         # default) when setting a background colour
         if self.__options['background_color']:
             self.__converter.set_transparency(False)
+        return latex
+
+    def __convert(self, formula, img_path, displaymath=False):
+        """convert(formula, img_path, displaymath=False) Convert given formula
+        with displaymath/inlinemath. This method wraps the formula in a tex
+        document, executes all the steps to produce a image and return the
+        positioning information for the HTML output. It does not check the
+        cache.
+
+        :param formula formula to convert
+        :param img_path image output path (relative to the configured base_path,
+                    see __init__)
+        :param displaymath whether or not to use displaymath during the conversion
+        :return dictionary with formula, position (pos), image path (path) and
+            formula style (displaymath, boolean) as a dictionary with the keys
+            in parenthesis
+        """
+        latex = self.__create_document(formula, displaymath)
         pos = self.__converter.convert(
             latex, os.path.join(self.__output_path,
                                 os.path.splitext(img_path)[0])
         )
         return {
+            'formula': formula,
             'pos': pos,
             'path': img_path,  # relative to self.__base_name(!)
             'displaymath': displaymath,
         }
 
+    def __convert_all_at_once(self, batch):
+        """Convert all formulas of the given batch using a single LaTeX
+        document, see __convert. A list with the data of each formula is
+        returned."""
+        latex = self.__create_document(batch[0][0], batch[0][3])
+        for formula, _pos, _path, dsp, _count in batch[1:]:
+            latex.add_equation(formula, dsp)
+        positions = self.__converter.convert_batch(
+            latex,
+            [
+                os.path.join(self.__output_path, os.path.splitext(img_path)[0])
+                for _f, _p, img_path, _d, _c in batch
+            ],
+        )
+        return [
+            {'formula': formula, 'pos': pos, 'path': img_path, 'displaymath': dsp}
+            for (formula, _p, img_path, dsp, _c), pos in zip(batch, positions)
+        ]
+
     def get_data_for(self, formula, display_math):
         """Simple wrapper around ImageCache, enriching the returned data with
         the information provided as arguments to this function.
 
         This helps when using a formula without its context.
         """
-        data = self.__cache.get_data_for(formula, display_math).copy()
-        data.update({'formula': formula, 'displaymath': display_math})
-        return data
+        data = self.__cache.get_data_for(formula, display_math)
+        return {**data, 'formula': formula, 'displaymath': display_math}
+
+    def lookup(self, formula, display_math):
+        """Return the same data as get_data_for or None, if the formula is
+        not cached."""
+        try:
+            return self.get_data_for(formula, display_math)
+        except KeyError:
+            return None
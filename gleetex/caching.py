@@ -24,14 +24,18 @@ Cache format:
     }
 
 The spacing in formulas is normalised to avoid converting the same formula with
-different spacing.
+different spacing. If conversion options are set, a hash of them prefixes each
+formula key ('<hash>:some formula'), so that images created with different
+options (e.g. by other documents sharing the directory) are kept apart.
 """
 
 import contextlib
+import hashlib
 import json
 import os
 
-CACHE_VERSION = '2.0'
+# 2.1: formula keys are prefixed by a hash of the conversion options
+CACHE_VERSION = '2.1'
 
 
 def normalize_formula(formula):
@@ -108,6 +112,13 @@ class ImageCache:
 
     c = cache = ImageCache(path='/img/gladtex.cache', base_path='chapter01')
     c.add_formula(…, 'img/eqn001.svg') # will result in chapter01/img/eqn001.svg
+
+    If `path` is None, the cache is kept in memory only; it is neither read
+    from nor written to disk.
+
+    The number of cached formulas can be limited using set_max_entries. The
+    least recently used formulas and their images are then removed when the
+    cache is written, unless they were used since the cache was loaded.
     """
 
     VERSION_STR = 'GladTeX__cache__version'
@@ -115,9 +126,13 @@ class ImageCache:
     def __init__(self, path='gladtex.cache', keep_old_cache=True, base_path=''):
         self.__cache = {}
         self.__set_version(CACHE_VERSION)
-        self.__cache_name = os.path.join(base_path, path)
+        self.__cache_name = None if path is None else os.path.join(base_path, path)
         self.__base_path = base_path
-        if os.path.exists(os.path.join(base_path, path)):
+        self.__max_entries = None
+        self.__options_prefix = ''  # see set_options
+        # formulas looked up or added since the cache was loaded
+        self.__used = set()
+        if self.__cache_name and os.path.exists(self.__cache_name):
             try:
                 self._read()
             except JsonParserException:
@@ -135,14 +150,41 @@ class ImageCache:
         """Set version of cache (data structure format)."""
         self.__cache[ImageCache.VERSION_STR] = version
 
+    def set_max_entries(self, count):
+        """Set the maximum number of formulas kept in the cache, None for no
+        limit."""
+        if count is not None and count < 1:
+            raise ValueError('maximum number of cache entries must be at least '
+                    '1, got %s' % count)
+        self.__max_entries = count
+
+    def set_options(self, options):
+        """Set the conversion options used to create the images.
+
+        `options` is a dictionary of JSON-serialisable values. Only formulas
+        added with the same options are found afterwards; those created with
+        other options stay in the cache, along with their images, since other
+        documents might still use them.
+        """
+        digest = hashlib.blake2b(
+            json.dumps(options, sort_keys=True).encode('utf-8'), digest_size=8
+        )
+        self.__options_prefix = digest.hexdigest() + ':'
+
+    def __get_key(self, formula):
+        """Return the key of a formula, for the configured options."""
+        return self.__options_prefix + normalize_formula(formula)
+
     def write(self):
         """Write cache to disk.
 
         The file name will be the one configured during initialisation
         of the cache.
         """
-        if not self.__cache:
+        if not self.__cache or not self.__cache_name:
             return
+        if self.__max_entries is not None and len(self) > self.__max_entries:
+            self._remove_least_recently_used()
         with open(self.__cache_name, 'w', encoding='UTF-8') as file:
             file.write(json.dumps(self.__cache))
 
@@ -162,8 +204,10 @@ class ImageCache:
         if os.path.exists(self.__cache_name):
             # pylint: disable=broad-except
             try:
-                with open(self.__cache_name) as file:
-                    self.__cache = json.load(file)
+                # the cache is written as UTF-8, which json detects from the
+                # raw bytes; this also skips the text decoding layer
+                with open(self.__cache_name, 'rb', buffering=0) as file:
+                    self.__cache = json.loads(file.read())
             except Exception as e:
                 msg = 'error while reading cache from %s: ' % os.path.abspath(
                     self.__cache_name
@@ -191,6 +235,9 @@ class ImageCache:
         recover_bools(self.__cache)
 
     def _remove_old_cache_and_files(self):
+        # start over, _read might have loaded the outdated entries
+        self.__cache = {}
+        self.__set_version(CACHE_VERSION)
         os.remove(self.__cache_name)
         directory = os.path.dirname(self.__cache_name)
         if not directory:
@@ -203,6 +250,27 @@ class ImageCache:
             if os.path.isfile(file):
                 os.remove(file)
 
+    def _remove_least_recently_used(self):
+        """Remove formulas and their images from the cache until the maximum
+        number of entries is reached. Formulas are kept in order of their
+        last use, formulas used since the cache was loaded are never removed."""
+        excess = len(self) - self.__max_entries
+        for formula in list(self.__cache):
+            if excess <= 0:
+                break
+            if formula == ImageCache.VERSION_STR or formula in self.__used:
+                continue
+            for value in self.__cache.pop(formula).values():
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.__base_path, value['path']))
+            excess -= 1
+
+    def __mark_used(self, formula):
+        """Move the given (normalised) formula to the end of the cache, which
+        is ordered by last use."""
+        self.__cache[formula] = self.__cache.pop(formula)
+        self.__used.add(formula)
+
     def add_formula(self, formula, pos, file_path, displaymath=False):
         """Add formula to cache.
 
@@ -228,7 +296,7 @@ class ImageCache:
             raise ValueError('the supplied arguments may not be empty/none')
         if not isinstance(displaymath, bool):
             raise ValueError('displaymath must be a boolean')
-        formula = normalize_formula(formula)
+        formula = self.__get_key(formula)
         if not formula in self.__cache:
             self.__cache[formula] = {}
         val = self.__cache[formula]
@@ -237,6 +305,7 @@ class ImageCache:
                 'pos': pos,
                 'path': file_path,
             }
+        self.__mark_used(formula)
 
     def remove_formula(self, formula, displaymath):
         """This method removes the given formula from the cache.
@@ -244,7 +313,7 @@ class ImageCache:
         A KeyError is raised, if the formula did not exist. Internally,
         formulas are normalized to detect similarities.
         """
-        formula = normalize_formula(formula)
+        formula = self.__get_key(formula)
         if not formula in self.__cache:
             raise KeyError('key %s not in cache' % formula)
         else:
@@ -279,7 +348,7 @@ class ImageCache:
         class. This method raises a KeyError if the formula wasn't
         found.
         """
-        formula = normalize_formula(formula)
+        formula = self.__get_key(formula)
         if not formula in self.__cache:
             raise KeyError(formula, displaymath)
         else:
@@ -294,6 +363,7 @@ class ImageCache:
                     del self.__cache[formula]
                     raise KeyError((formula, displaymath))
                 else:
+                    self.__mark_used(formula)
                     return value[displaymath]
             else:
                 raise KeyError((formula, displaymath))
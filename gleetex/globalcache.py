@@ -0,0 +1,110 @@
+# (c) 2013-2022 Sebastian Humenda
+# This code is licenced under the terms of the LGPL-3+, see the file COPYING for
+# more details.
+"""This module contains the GlobalCache, a content-addressed store for formula
+images shared between all documents of a user.
+
+The ImageCache only knows about the formulas of a single image directory. The
+global cache instead keys each image by a hash of the formula, the formula style
+and all conversion options, so that a formula converted for one document can be
+copied into the image directory of another one without running LaTeX.
+
+Layout of the cache directory:
+
+    ab/                     # first two hexadecimal digits of the key
+        ab12...ef.json      # {'pos': {...}, 'file': 'ab12...ef.svg'}
+        ab12...ef.svg       # the image
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from .caching import normalize_formula
+
+
+def default_directory():
+    """Return the default location of the global cache, following the XDG base
+    directory specification."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'
+    )
+    return os.path.join(cache_home, 'gladtex')
+
+
+class GlobalCache:
+    """Store and retrieve formula images, independently of a document.
+
+    c = GlobalCache(directory)
+    c.store(formula, displaymath, options, 'img/eqn000.svg', pos)
+    hit = c.lookup(formula, displaymath, options)
+    if hit:
+        image_path, pos = hit
+
+    The options must be JSON-serialisable and describe everything which
+    influences the resulting image.
+    """
+
+    def __init__(self, directory):
+        self.__directory = directory
+
+    def _get_key(self, formula, displaymath, options):
+        """Hash the formula, its style and the options into a key."""
+        data = json.dumps(
+            [normalize_formula(formula), displaymath, options], sort_keys=True
+        )
+        return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _get_metadata_path(self, key):
+        return os.path.join(self.__directory, key[:2], key + '.json')
+
+    def lookup(self, formula, displaymath, options):
+        """Return a tuple with the path to the cached image and its
+        positioning information or None, if the formula is not cached."""
+        meta_path = self._get_metadata_path(
+            self._get_key(formula, displaymath, options)
+        )
+        try:
+            with open(meta_path, 'rb') as file:
+                data = json.loads(file.read())
+        except (OSError, ValueError):
+            return None  # not cached or incomplete
+        image_path = os.path.join(os.path.dirname(meta_path), data['file'])
+        if not os.path.exists(image_path):
+            return None
+        return (image_path, data['pos'])
+
+    def store(self, formula, displaymath, options, image_path, pos):
+        """Copy the image of a converted formula into the cache and record its
+        positioning information."""
+        key = self._get_key(formula, displaymath, options)
+        meta_path = self._get_metadata_path(key)
+        directory = os.path.dirname(meta_path)
+        os.makedirs(directory, exist_ok=True)
+        file_name = key + os.path.splitext(image_path)[1]
+        # copy to temporary files and move them in place, so that concurrent
+        # GladTeX runs never see partially written entries
+        self.__write_atomically(
+            os.path.join(directory, file_name),
+            lambda tmp: shutil.copyfile(image_path, tmp),
+        )
+
+        def write_metadata(tmp):
+            with open(tmp, 'w', encoding='utf-8') as file:
+                json.dump({'pos': pos, 'file': file_name}, file)
+
+        self.__write_atomically(meta_path, write_metadata)
+
+    def __write_atomically(self, path, write):
+        """Call `write` with a temporary file name and move the written file
+        to `path` afterwards."""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):  # not moved, writing failed
+                os.remove(tmp)
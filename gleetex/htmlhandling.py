@@ -15,6 +15,7 @@ from abc import abstractmethod
 import collections
 import enum
 import html
+from operator import itemgetter
 import os
 import posixpath
 import re
@@ -26,6 +27,15 @@ from . import typesetting
 CHARSET_PATTERN = re.compile(
     rb'(?:content="text/html; charset=(.*?)"|charset="(.*?)")')
 
+# anything which could open a formula, see EqnParser
+_EQUATION_START = re.compile(r'<\s*eq', re.IGNORECASE)
+_EQUATION_START_BYTES = re.compile(rb'<\s*eq', re.IGNORECASE)
+
+# number of characters collected by write_html before writing them out
+WRITE_BLOCK_SIZE = 1 << 16
+# arguments for ImageFormatter.format, from a converted formula
+_FORMAT_ARGUMENTS = itemgetter('pos', 'formula', 'path', 'displaymath')
+
 
 class ParseException(Exception):
     """Exception to propagate a parsing error."""
@@ -47,12 +57,20 @@ def get_position(document, index):
 
     Note: lines and positions are counted from 0.
     """
-    line = document[: index + 1].count('\n')
+    line = document.count('\n', 0, index + 1)
     if document[index] == '\n':
         return (line, 0)
-    newline = document[: index + 1].rfind('\n')
+    newline = document.rfind('\n', 0, index + 1)
     newline = newline if newline >= 0 else 0
-    return (line, len(document[newline:index]))
+    return (line, index - newline)
+
+
+def contains_formulas(document):
+    """Return whether the given string or bytes instance might contain a
+    formula. If not, the document can be used as it is, without parsing."""
+    if isinstance(document, bytes):
+        return _EQUATION_START_BYTES.search(document) is not None
+    return _EQUATION_START.search(document) is not None
 
 
 def find_anycase(where, what):
@@ -85,6 +103,8 @@ class EqnParser:
         self.__document = None
         self.__data = []
         self.__encoding = None
+        # (index, number of newlines before index) of the last position lookup
+        self.__last_position = (0, 0)
 
     def feed(self, document):
         """Feed a string or a bytes instance and start parsing.
@@ -108,6 +128,7 @@ class EqnParser:
                 ) from e
             self.__encoding = encoding
         self.__document = document[:]
+        self.__last_position = (0, 0)
         self._parse()
 
     def find_with_offset(self, doc, start, what):
@@ -115,14 +136,12 @@ class EqnParser:
         staking the offset into account.
 
         Returned is the absolute position (so offset + relative match
-        position) or -1 for no hit.
+        position) or -1 for no hit. The document is not copied.
         """
         if isinstance(what, str):
-            pos = doc[start:].find(what)
-        else:
-            match = what.search(doc[start:])
-            pos = -1 if not match else match.span()[0]
-        return pos if pos == -1 else pos + start
+            return doc.find(what, start)
+        match = what.search(doc, start)
+        return -1 if not match else match.start()
 
     def _parse(self):
         """This function parses the document, while maintaining state using the
@@ -132,9 +151,14 @@ class EqnParser:
         # the handler methods
         doc = self.__document[:].lower()
 
-        end = len(self.__document) - 1
+        end = len(self.__document)
         eq_start = re.compile(r'<\s*eq\s*(.*?)>')
 
+        def append_raw(stop):
+            # empty chunks between adjacent tags are not recorded at all
+            if stop > start_pos:
+                self.__data.append(self.__document[start_pos:stop])
+
         start_pos = 0
         while start_pos < end:
             comment = self.find_with_offset(doc, start_pos, '<!--')
@@ -143,38 +167,50 @@ class EqnParser:
                 formula
             ):  # both present, take closest
                 if comment < formula:
-                    self.__data.append(self.__document[start_pos:comment])
+                    append_raw(comment)
                     start_pos = self.handle_comment(comment)
                 else:
-                    self.__data.append(self.__document[start_pos:formula])
+                    append_raw(formula)
                     start_pos = self.handle_equation(formula)
             elif in_document(formula):
-                self.__data.append(self.__document[start_pos:formula])
+                append_raw(formula)
                 start_pos = self.handle_equation(formula)
             elif in_document(comment):
-                self.__data.append(self.__document[start_pos:comment])
+                append_raw(comment)
                 start_pos = self.handle_comment(comment)
             else:  # only data left
-                self.__data.append(self.__document[start_pos:])
+                append_raw(end)
                 start_pos = end
 
+    def _get_position(self, index):
+        """Like get_position, but only count the lines since the last lookup,
+        which avoids rescanning the document from the start for each formula."""
+        last_index, line = self.__last_position
+        if index < last_index:
+            return get_position(self.__document, index)
+        line += self.__document.count('\n', last_index, index + 1)
+        self.__last_position = (index + 1, line)
+        if self.__document[index] == '\n':
+            return (line, 0)
+        newline = self.__document.rfind('\n', 0, index + 1)
+        return (line, index - max(newline, 0))
+
     def handle_equation(self, start_pos):
         """Parse an equation.
 
         The given offset should mark the beginning of this equation.
         """
         # get line and column of `start_pos`
-        lnum, pos = get_position(self.__document, start_pos)
+        lnum, pos = self._get_position(start_pos)
 
-        match = EqnParser.State.Equation.value.search(
-            self.__document[start_pos:])
+        match = EqnParser.State.Equation.value.search(self.__document, start_pos)
         if not match:
             next_eq = find_anycase(self.__document[start_pos + 1:], '<eq')
             closing = find_anycase(self.__document[start_pos:], '</eq>')
             if -1 < next_eq < closing and closing > -1:
                 raise ParseException('Unclosed tag found', (lnum, pos))
             raise ParseException('Malformed equation tag found', (lnum, pos))
-        end = start_pos + match.span()[1]
+        end = match.end()
         attrs, formula = match.groups()
         if '<eq>' in formula or '<EQ' in formula:
             raise ParseException(
@@ -197,15 +233,14 @@ class EqnParser:
         return end
 
     def handle_comment(self, start_pos):
-        match = EqnParser.State.Comment.value.search(
-            self.__document[start_pos:])
+        match = EqnParser.State.Comment.value.search(self.__document, start_pos)
         if not match:
             lnum, pos = get_position(self.__document, start_pos)
             # this could be a parser issue, too
             raise ParseException(
                 'Improperly formatted comment found', (lnum, pos))
         self.__data.append('<!--%s-->' % match.groups()[0])
-        return start_pos + match.span()[1]  # return end of match
+        return match.end()
 
     def get_encoding(self):
         """Return the parsed encoding from the HTML meta data.
@@ -220,7 +255,7 @@ class EqnParser:
         These are either strings or tuples with formula information, see
         class documentation.
         """
-        return [x for x in self.__data if x]  # filter empty bits
+        return self.__data
 
 
 def generate_label(formula):
@@ -504,15 +539,21 @@ def write_html(file, document, formatter):
     A processed image is a former formula converted to an image with
     additional meta data. This is passed to the format function of the
     supplied formatter and the result is written to the given (open)
-    file handle.
+    file handle. The output is collected and written in blocks of roughly
+    WRITE_BLOCK_SIZE characters.
     """
+    buffer = []
+    size = 0
+    fmt = formatter.format
     for chunk in document:
-        if isinstance(chunk, dict):
-            is_displaymath = chunk['displaymath']
-            file.write(
-                formatter.format(
-                    chunk['pos'], chunk['formula'], chunk['path'], is_displaymath
-                )
-            )
-        else:
-            file.write(chunk)
+        # exact type check, cheaper than isinstance for this hot loop
+        if type(chunk) is dict:  # pylint: disable=unidiomatic-typecheck
+            chunk = fmt(*_FORMAT_ARGUMENTS(chunk))
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= WRITE_BLOCK_SIZE:
+            file.write(''.join(buffer))
+            buffer.clear()
+            size = 0
+    if buffer:
+        file.write(''.join(buffer))
@@ -20,6 +20,10 @@ DVIPNG_REGEX = re.compile(r'^ depth=(-?\d+) height=(\d+) width=(\d+)')
 DVISVGM_DEPTH_REGEX = re.compile(
     r'^\s*width=.*?pt, height=.*?pt, depth=(.*?)pt')
 DVISVGM_SIZE_REGEX = re.compile(r'^\s*graphic size: (.*?)pt x (.*?)pt')
+# seconds LaTeX, dvipng and dvisvgm may take for a single page and for each
+# additional page of a document
+TIMEOUT = 20
+TIMEOUT_PER_PAGE = 2
 
 
 def remove_all(*files):
@@ -32,12 +36,18 @@ def remove_all(*files):
             pass
 
 
-def proc_call(cmd, cwd=None, install_recommends=True):
+def get_timeout(pages):
+    """Return the timeout in seconds for processing a document with the given
+    number of pages."""
+    return TIMEOUT + TIMEOUT_PER_PAGE * (pages - 1)
+
+
+def proc_call(cmd, cwd=None, install_recommends=True, timeout=TIMEOUT):
     """Execute cmd (list of arguments) as a subprocess.
 
     Returned is a tuple with stdout and stderr, decoded if not None. If
     the return value is not equal 0, a subprocess error is raised.
-    Timeouts will happen after 20 seconds.
+    Timeouts will happen after `timeout` seconds (20 by default).
     """
     with subprocess.Popen(
         cmd,
@@ -49,7 +59,7 @@ def proc_call(cmd, cwd=None, install_recommends=True):
         try:
             data = [
                 d.decode(sys.getdefaultencoding(), errors='surrogateescape')
-                for d in proc.communicate(timeout=20)
+                for d in proc.communicate(timeout=timeout)
                 if d
             ]
             if proc.wait():
@@ -192,7 +202,12 @@ class Tex2img:
             os.path.basename(tex_fn),
         ]
         try:
-            proc_call(cmd, cwd=path, install_recommends='texlive-recommended')
+            proc_call(
+                cmd,
+                cwd=path,
+                install_recommends='texlive-recommended',
+                timeout=get_timeout(tex_document.get_equation_count()),
+            )
         except subprocess.SubprocessError as e:
             remove_all(dvi_fn)
             msg = ''
@@ -251,6 +266,53 @@ class Tex2img:
             remove_all('%s.%s' % (base_name, self.__format.value))
             raise
 
+    def convert_batch(self, tex_document, base_names):
+        """Convert a TeX document with several formulas into one image per
+        formula.
+
+        The document is typeset by a single LaTeX run, each formula ends
+        up on a page of its own. The images are named after the given
+        base names, in the order of the formulas within the document.
+        This function returns a list with the positioning information of
+        each image.
+        """
+        if not isinstance(tex_document, LaTeXDocument):
+            raise TypeError(
+                ('expected object of type typesetting.LaTeXDocument,' ' got %s')
+                % type(tex_document)
+            )
+        if tex_document.get_equation_count() != len(base_names):
+            raise ValueError(
+                'got %d base names for %d formulas'
+                % (len(base_names), tex_document.get_equation_count())
+            )
+        dvi = '%s.dvi' % base_names[0]
+        output_names = ['%s.%s' % (b, self.__format.value) for b in base_names]
+        try:
+            self.create_dvi(tex_document, dvi)
+            all_dimensions = self.create_images(dvi, output_names)
+            if self.__is_epub:
+                for dimensions in all_dimensions:
+                    for key, val in dimensions.items():
+                        dimensions[key] = int(round(val))
+            return all_dimensions
+        except OSError:
+            remove_all(*output_names)
+            raise
+
+    def create_images(self, dvi_fn, output_names):
+        """Create one image per page of the given DVI file, using either
+        dvisvgm or dvipng.
+
+        The pages are saved to the given output file names."""
+        if self.__format == Format.Png:
+            dpi = fontsize2dpi(
+                self.__size[1]) if self.__size[1] else self.__size[0]
+            return create_pngs(dvi_fn, output_names, dpi, self.__background)
+        if not self.__size[1]:
+            self.__size[1] = 12  # 12 pt
+        return create_svgs(dvi_fn, output_names)
+
     def parse_latex_log(self, logdata):
         """Parse the LaTeX error output and return the relevant part of it."""
         if not logdata:
@@ -294,6 +356,35 @@ def create_png(dvi_fn, output_name, dpi, background):
     """
     if not output_name:
         raise ValueError('Empty output_name')
+    data = _call_image_converter(
+        _get_dvipng_cmd(dvi_fn, output_name, dpi, background),
+        dvi_fn,
+        [output_name],
+        'dvipng',
+    )
+    dimensions = parse_dvipng_output(data)
+    if not dimensions:
+        raise ValueError('Could not parse dvi output: ' + repr(data))
+    return dimensions[0]
+
+
+def create_pngs(dvi_fn, output_names, dpi, background):
+    """Create a PNG file for each page of a given dvi file, see create_png.
+
+    :param output_names list with one output file name per page
+    :return list with the dimensions of each image
+    :raises ValueError raised whenever dvipng output couldn't be parsed or
+        the number of pages doesn't match the number of output names
+    """
+    pattern = '%s-%%d.png' % os.path.splitext(output_names[0])[0]
+    pages = [pattern % page for page in range(1, len(output_names) + 1)]
+    data = _call_image_converter(
+        _get_dvipng_cmd(dvi_fn, pattern, dpi, background), dvi_fn, pages, 'dvipng'
+    )
+    return _rename_pages(pages, output_names, parse_dvipng_output(data))
+
+
+def _get_dvipng_cmd(dvi_fn, output_name, dpi, background):
     cmd = ['dvipng', '-q*', '-D', str(dpi)]
     if background == 'transparent':
         cmd += ['-bg', background]
@@ -305,19 +396,19 @@ def create_png(dvi_fn, output_name, dpi, background):
         output_name,
         dvi_fn,
     ]
-    data = None
-    try:
-        data = proc_call(cmd, install_recommends='dvipng')
-    except subprocess.SubprocessError:
-        remove_all(output_name)
-        raise
-    finally:
-        remove_all(dvi_fn)
+    return cmd
+
+
+def parse_dvipng_output(data):
+    """Return the dimensions of each page, as printed by dvipng."""
+    dimensions = []
     for line in data.split('\n'):
         found = DVIPNG_REGEX.search(line)
         if found:
-            return dict(zip(['depth', 'height', 'width'], map(float, found.groups())))
-    raise ValueError('Could not parse dvi output: ' + repr(data))
+            dimensions.append(
+                dict(zip(['depth', 'height', 'width'], map(float, found.groups())))
+            )
+    return dimensions
 
 
 def create_svg(dvi_fn, output_name):
@@ -332,7 +423,40 @@ def create_svg(dvi_fn, output_name):
     """
     if not output_name:
         raise ValueError('Empty output_name')
-    cmd = [
+    data = _call_image_converter(
+        _get_dvisvgm_cmd(dvi_fn, output_name),
+        dvi_fn,
+        [output_name],
+        'texlive-binaries',
+    )
+    dimensions = parse_dvisvgm_output(data)
+    if not dimensions:
+        raise ValueError('Could not parse dvisvgm output: ' + repr(data))
+    return dimensions[0]
+
+
+def create_svgs(dvi_fn, output_names):
+    """Create a SVG file for each page of a given dvi file, see create_svg.
+
+    :param output_names list with one output file name per page
+    :return list with the dimensions of each image
+    :raises ValueError raised whenever dvisvgm output couldn't be parsed or
+        the number of pages doesn't match the number of output names
+    """
+    base_name = os.path.splitext(output_names[0])[0]
+    digits = len(str(len(output_names)))
+    pages = [
+        '%s-%0*d.svg' % (base_name, digits, page)
+        for page in range(1, len(output_names) + 1)
+    ]
+    cmd = _get_dvisvgm_cmd(dvi_fn, '%s-%%%dp.svg' % (base_name, digits))
+    cmd.insert(-1, '--page=1-')
+    data = _call_image_converter(cmd, dvi_fn, pages, 'texlive-binaries')
+    return _rename_pages(pages, output_names, parse_dvisvgm_output(data))
+
+
+def _get_dvisvgm_cmd(dvi_fn, output_name):
+    return [
         'dvisvgm',
         '--exact',
         '--no-fonts',
@@ -341,14 +465,27 @@ def create_svg(dvi_fn, output_name):
         '--bbox=preview',
         dvi_fn,
     ]
-    data = None
+
+
+def _call_image_converter(cmd, dvi_fn, output_names, install_recommends):
+    """Run dvipng or dvisvgm and return its output. The output files are
+    removed if the command fails, the dvi file is removed in any case."""
     try:
-        data = proc_call(cmd, install_recommends='texlive-binaries')
+        return proc_call(
+            cmd,
+            install_recommends=install_recommends,
+            timeout=get_timeout(len(output_names)),
+        )
     except subprocess.SubprocessError:
-        remove_all(output_name)
+        remove_all(*output_names)
         raise
     finally:
         remove_all(dvi_fn)
+
+
+def parse_dvisvgm_output(data):
+    """Return the dimensions of each page, as printed by dvisvgm."""
+    dimensions = []
     pos = {}
     for line in data.split('\n'):
         if not pos:
@@ -368,5 +505,25 @@ def create_svg(dvi_fn, output_name):
                         )
                     )
                 )
-                return pos
-    raise ValueError('Could not parse dvisvgm output: ' + repr(data))
+                dimensions.append(pos)
+                pos = {}
+    return dimensions
+
+
+def _rename_pages(pages, output_names, dimensions):
+    """Move the images of all pages to their output file names. The
+    dimensions of the pages are returned, unless their number doesn't match
+    the number of output names."""
+    if len(dimensions) != len(output_names):
+        remove_all(*pages)
+        raise ValueError(
+            'expected %d pages, got dimensions for %d'
+            % (len(output_names), len(dimensions))
+        )
+    try:
+        for page, output_name in zip(pages, output_names):
+            os.replace(page, output_name)
+    except OSError:
+        remove_all(*pages)
+        raise
+    return dimensions
@@ -14,7 +14,6 @@ import json
 import sys
 
 from . import htmlhandling
-from . import pandoc
 
 ParseException = (
     htmlhandling.ParseException
@@ -59,6 +58,8 @@ def parse_document(doc, fmt):
         encoding = encoding if encoding else 'utf-8'
         doc = docparser.get_data()
     elif fmt == Format.PANDOCFILTER:
+        from . import pandoc  # only needed in filter mode
+
         if isinstance(doc, bytes):
             doc = doc.decode(sys.getdefaultencoding())
         ast = json.loads(doc)
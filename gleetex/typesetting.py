@@ -8,8 +8,6 @@ resulting image."""
 
 import inspect
 
-from . import unicode
-
 FORMATTING_COMMANDS = [
     '\\ ',
     '\\,',
@@ -121,6 +119,9 @@ def replace_unicode_characters(characters, is_math, replace_alphabeticals=True):
         elif character.isalpha() and not replace_alphabeticals:
             result.append(character)
         else:
+            # the table is large, load it only once a character needs lookup
+            from . import unicode
+
             mode = unicode.LaTeXMode.mathmode if is_math else unicode.LaTeXMode.textmode
             commands = unicode.unicode_table.get(ord(character))
             if not commands:  # unicode point missing in table
@@ -174,6 +175,7 @@ class LaTeXDocument:
         self.__encoding = None
         self.__equation = eqn
         self.__displaymath = False
+        self.__further_equations = []
         self.__fontsize = 12
         self.__background_color = None
         self.__foreground_color = None
@@ -253,10 +255,26 @@ class LaTeXDocument:
     def is_displaymath(self):
         return self.__displaymath
 
+    def add_equation(self, eqn, displaymath=False):
+        """Add another formula to the document.
+
+        Each formula is typeset on a page of its own, so that a single
+        LaTeX run can produce the images for several formulas."""
+        if not isinstance(displaymath, bool):
+            raise TypeError('Displaymath parameter must be of type bool.')
+        self.__further_equations.append((eqn, displaymath))
+
+    def get_equation_count(self):
+        """Return the number of formulas (and hence pages) of the document."""
+        return 1 + len(self.__further_equations)
+
     def _get_encoding_preamble(self):
         # first check whether there are umlauts within the formula and if so, an
         # encoding has been set
-        if any(ord(ch) > 128 for ch in self.__equation) and not self.__replace_nonascii:
+        equations = [self.__equation] + [e for e, _d in self.__further_equations]
+        if not self.__replace_nonascii and any(
+            ord(ch) > 128 for eqn in equations for ch in eqn
+        ):
             if not self.__encoding:
                 raise ValueError(
                     (
@@ -327,20 +345,38 @@ class LaTeXDocument:
             )
         return (''.join(color_defs), color_body)
 
-    def _format_document(self, preamble):
-        """Return a formatted LaTeX document with the specified formula
-        embedded."""
-        opening, closing = None, None
+    def _format_equation(self, eqn, displaymath):
+        """Return the preview environment for a single formula, occupying a
+        page of its own.
+
+        Each page is enclosed in a group and starts with a reset equation
+        counter, so that the image of a formula doesn't depend on the formulas
+        before it in the same document: definitions stay local to their page
+        and numbered environments always start at (1)."""
         if self.__maths_env:
             opening = '\\begin{%s}' % self.__maths_env
             closing = '\\end{%s}' % self.__maths_env
         else:
             # determine characters with which to surround the formula
-            opening = '\\[' if self.__displaymath else '\\('
-            closing = '\\]' if self.__displaymath else '\\)'
-        formula = self.__equation.lstrip().rstrip()
+            opening = '\\[' if displaymath else '\\('
+            closing = '\\]' if displaymath else '\\)'
+        formula = eqn.lstrip().rstrip()
         if self.__replace_nonascii:
             formula = escape_unicode_maths(formula, replace_alphabeticals=True)
+        return (
+            f'\\begingroup\\setcounter{{equation}}{{0}}%\n'
+            f'\\noindent%\n\\begin{{preview}}{{%s\n'
+            f'{opening}{formula}{closing}}}\\end{{preview}}\\endgroup\n'
+        )
+
+    def _format_document(self, preamble):
+        """Return a formatted LaTeX document with the specified formula(s)
+        embedded."""
+        body = '\n'.join(
+            self._format_equation(eqn, dsp)
+            for eqn, dsp in [(self.__equation, self.__displaymath)]
+            + self.__further_equations
+        )
         fontsize = 'fontsize=%ipt' % self.__fontsize
         color_preamble, color_body = self._format_colors()
         return inspect.cleandoc(
@@ -354,9 +390,7 @@ class LaTeXDocument:
             % tightpage must be last, see its package docs
             \\usepackage[active,textmath,displaymath,tightpage]{{preview}}\n
             \\begin{{document}}\n
-            \\noindent%
-            \\begin{{preview}}{{%s
-            {opening}{formula}{closing}}}\\end{{preview}}\n
+            {body}
             \\end{{document}}\n
         """
         )
@@ -1,10 +1,13 @@
 # pylint: disable=too-many-public-methods,import-error,too-few-public-methods,missing-docstring,unused-variable
+import io
 import os
 import shutil
+import subprocess
 import tempfile
 import unittest
 from unittest.mock import patch
 from gleetex import cachedconverter, image
+from gleetex.__main__ import Main
 from gleetex.caching import JsonParserException
 from gleetex.image import remove_all
 
@@ -57,10 +60,25 @@ class Tex2imgMock:
                    '.log', basename + '.aux')
         return {'depth': 9, 'height': 8, 'width': 7}
 
+    def convert_batch(self, tx, basenames):
+        return [self.convert(tx, basename) for basename in basenames]
+
     def parse_log(self, _logdata):
         return {}
 
 
+class FailingBatchTex2imgMock(Tex2imgMock):
+    """Batch conversion fails, single formulas fail if they contain "fail"."""
+
+    def convert_batch(self, tx, basenames):
+        raise subprocess.SubprocessError('batch failed')
+
+    def convert(self, tx, basename):
+        if 'fail' in str(tx):
+            raise subprocess.SubprocessError('formula failed')
+        return super().convert(tx, basename)
+
+
 class TestCachedConverter(unittest.TestCase):
     # pylint: disable=protected-access
     def setUp(self):
@@ -100,6 +118,14 @@ class TestCachedConverter(unittest.TestCase):
         c = cachedconverter.CachedConverter('subdirectory')
         self.assertRaises(ValueError, c.set_option, 'cxzbiucxzbiuxzb', 'muh')
 
+    def test_that_unknown_options_in_update_trigger_exception(self):
+        c = cachedconverter.CachedConverter('subdirectory')
+        self.assertRaises(ValueError, c.update_options, {'png': True, 'cxzbiu': 1})
+
+    def test_that_invalid_thread_count_triggers_exception(self):
+        c = cachedconverter.CachedConverter('subdirectory')
+        self.assertRaises(ValueError, c.set_thread_count, 0)
+
     def test_that_invalid_caches_trigger_error_by_default(self):
         with open('gladtex.cache', 'w') as f:
             f.write('invalid cache')
@@ -124,6 +150,14 @@ class TestCachedConverter(unittest.TestCase):
         c.convert_all(formulas)
         self.assertTrue(c.get_data_for('\\tau', False))
 
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_lookup_returns_none_for_unconverted_formulas(self):
+        c = cachedconverter.CachedConverter('.')
+        self.assertIsNone(c.lookup('\\tau', False))
+        c.convert_all([mk_eqn('\\tau')])
+        self.assertEqual(c.lookup('\\tau', False)['path'], 'eqn000.svg')
+        self.assertIsNone(c.lookup('\\tau', True))
+
     @patch('gleetex.image.Tex2img', Tex2imgMock)
     def test_that_file_names_are_correctly_picked(self):
         formulas = [mk_eqn('\\tau')]
@@ -134,6 +168,23 @@ class TestCachedConverter(unittest.TestCase):
         self.assertTrue(len(to_convert), 1)
         self.assertEqual(to_convert[0][2], 'eqn002.svg')
 
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_file_names_are_picked_relative_to_base_path(self):
+        os.makedirs(os.path.join('out', 'img'))
+        write(os.path.join('out', 'img', 'eqn000.svg'))
+        write('eqn001.svg')  # in the working directory, does not matter
+        c = cachedconverter.CachedConverter('out', img_dir='img')
+        to_convert = c._get_formulas_to_convert([mk_eqn('\\tau')])
+        self.assertEqual(to_convert[0][2], os.path.join('img', 'eqn001.svg'))
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_recurring_formulas_are_only_converted_once(self):
+        formulas = [mk_eqn('a + b'), mk_eqn('a  +  b'), ((1, 1), True, 'a + b')]
+        c = cachedconverter.CachedConverter('')
+        to_convert = c._get_formulas_to_convert(formulas)
+        self.assertEqual([(f[0], f[3]) for f in to_convert],
+                [('a + b', False), ('a + b', True)])
+
     @patch('gleetex.image.Tex2img', Tex2imgMock)
     def test_that_all_converted_formulas_are_in_cache_and_meta_info_correct(self):
         formulas = [mk_eqn('a_{%d}' % i, pos=(i, i), count=i)
@@ -167,3 +218,132 @@ class TestCachedConverter(unittest.TestCase):
             len(formulas) + 1,
             'present files:\n%s' % ', '.join(os.listdir('.')),
         )
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_formulas_are_reconverted_if_options_change(self):
+        formulas = [mk_eqn('\\tau')]
+        c = cachedconverter.CachedConverter('.')
+        c.convert_all(formulas)
+        c = cachedconverter.CachedConverter('.')
+        self.assertEqual(c._get_formulas_to_convert(formulas), [])
+        c.set_option('preamble', '\\usepackage{amsmath}')
+        c.convert_all(formulas)
+        self.assertEqual(c.get_data_for('\\tau', False)['path'], 'eqn001.svg')
+        self.assertEqual(get_number_of_files('.'), 3)
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_other_documents_keep_their_images_if_options_differ(self):
+        # a second document with other options shares the image directory
+        first = cachedconverter.CachedConverter('.')
+        first.convert_all([mk_eqn('\\tau'), mk_eqn('\\pi')])
+        paths = [first.get_data_for(f, False)['path'] for f in ('\\tau', '\\pi')]
+        second = cachedconverter.CachedConverter('.')
+        second.set_option('foreground_color', 'FF0000')
+        second.convert_all([mk_eqn('\\tau')])
+        self.assertNotIn(second.get_data_for('\\tau', False)['path'], paths)
+        first = cachedconverter.CachedConverter('.')
+        for formula, path in zip(('\\tau', '\\pi'), paths):
+            self.assertEqual(first.get_data_for(formula, False)['path'], path)
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(first._get_formulas_to_convert([mk_eqn('\\pi')]), [])
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_default_font_size_given_explicitly_reuses_images(self):
+        formulas = [mk_eqn('\\tau')]
+        main = Main()
+        c = cachedconverter.CachedConverter('.')
+        main.set_options(c, main._parse_args(['x.htex']))
+        c.convert_all(formulas)
+        c = cachedconverter.CachedConverter('.')
+        main.set_options(c, main._parse_args(['-f', '12', 'x.htex']))
+        self.assertEqual(c._get_formulas_to_convert(formulas), [])
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_no_cache_is_written_if_disabled(self):
+        formulas = [mk_eqn('\\tau')]
+        c = cachedconverter.CachedConverter('.', use_cache=False)
+        c.convert_all(formulas)
+        self.assertTrue(c.get_data_for('\\tau', False))
+        self.assertEqual(os.listdir('.'), ['eqn000.svg'])
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_cached_images_are_kept_without_cache(self):
+        c = cachedconverter.CachedConverter('.')
+        c.convert_all([mk_eqn('\\tau')])
+        write('eqn000.svg', 'tau')
+        c = cachedconverter.CachedConverter('.', use_cache=False)
+        c.convert_all([mk_eqn('\\pi')])
+        self.assertEqual(c.get_data_for('\\pi', False)['path'], 'eqn001.svg')
+        with open('eqn000.svg', encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'tau')
+        c = cachedconverter.CachedConverter('.')
+        self.assertEqual(c.get_data_for('\\tau', False)['path'], 'eqn000.svg')
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_formulas_are_converted_in_batches(self):
+        formulas = [mk_eqn('a_{%d}' % i, pos=(i, i)) for i in range(5)]
+        c = cachedconverter.CachedConverter('.')
+        c.set_thread_count(2)
+        with patch.object(Tex2imgMock, 'convert_batch', autospec=True,
+                side_effect=Tex2imgMock.convert_batch) as convert_batch:
+            c.convert_all(formulas)
+        self.assertEqual(convert_batch.call_count, 2)
+        for _pos, dsp, formula in formulas:
+            self.assertTrue(c.get_data_for(formula, dsp))
+
+    @patch('gleetex.image.Tex2img', FailingBatchTex2imgMock)
+    def test_that_failed_batches_are_converted_formula_by_formula(self):
+        formulas = [mk_eqn('a'), mk_eqn('\\fail', pos=(2, 3)), mk_eqn('b')]
+        c = cachedconverter.CachedConverter('.')
+        c.set_thread_count(1)
+        with self.assertRaises(cachedconverter.ConversionException) as e:
+            c.convert_all(formulas)
+        self.assertEqual(e.exception.formula, '\\fail')
+        self.assertEqual(e.exception.formula_count, 2)
+        self.assertEqual(e.exception.src_line_number, 3)
+        # formula before the failing one was cached
+        self.assertTrue(c.get_data_for('a', False))
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_formulas_from_global_cache_are_not_converted(self):
+        c = cachedconverter.CachedConverter('first')
+        c.set_global_cache('global')
+        c.convert_all([mk_eqn('\\tau')])
+        c = cachedconverter.CachedConverter('second')
+        c.set_global_cache('global')
+        with patch.object(Tex2imgMock, 'convert', autospec=True) as convert:
+            c.convert_all([mk_eqn('\\tau')])
+        convert.assert_not_called()
+        data = c.get_data_for('\\tau', False)
+        self.assertEqual(data['pos'], {'depth': 9, 'height': 8, 'width': 7})
+        self.assertTrue(os.path.exists(os.path.join('second', data['path'])))
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_failing_global_cache_store_is_only_warned_about(self):
+        c = cachedconverter.CachedConverter('.')
+        c.set_global_cache('global')
+        with patch(
+            'gleetex.globalcache.GlobalCache.store', side_effect=OSError('full')
+        ) as store, patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            c.convert_all([mk_eqn('\\tau'), mk_eqn('\\pi')])
+        self.assertEqual(store.call_count, 1)
+        self.assertEqual(stderr.getvalue().count('full'), 1)
+        for formula in ('\\tau', '\\pi'):
+            self.assertTrue(c.get_data_for(formula, False))
+
+    @patch('gleetex.image.Tex2img', Tex2imgMock)
+    def test_that_formulas_are_converted_if_global_cache_is_unreadable(self):
+        c = cachedconverter.CachedConverter('first')
+        c.set_global_cache('global')
+        c.convert_all([mk_eqn('\\tau'), mk_eqn('\\pi')])
+        c = cachedconverter.CachedConverter('second')
+        c.set_global_cache('global')
+        with patch(
+            'gleetex.cachedconverter.shutil.copyfile', side_effect=OSError('denied')
+        ) as copyfile, patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            c.convert_all([mk_eqn('\\tau'), mk_eqn('\\pi')])
+        self.assertEqual(copyfile.call_count, 1)
+        self.assertEqual(stderr.getvalue().count('denied'), 1)
+        for formula in ('\\tau', '\\pi'):
+            data = c.get_data_for(formula, False)
+            self.assertTrue(os.path.exists(os.path.join('second', data['path'])))
@@ -72,6 +72,15 @@ class test_caching(unittest.TestCase):
         self.assertEqual(data['pos'], self.pos)
         self.assertEqual(data['path'], 'file.png')
 
+    def test_that_non_ascii_formulas_are_read_back(self):
+        c = caching.ImageCache()
+        formula = '\\text{Größe}'
+        write('file.png', 'dummy')
+        c.add_formula(formula, self.pos, 'file.png', displaymath=False)
+        c.write()
+        c = caching.ImageCache()
+        self.assertTrue(c.contains(formula, False))
+
     def test_formulas_are_not_added_twice(self):
         form1 = r'\ln(x) \neq e^x'
         write('spass.png', 'binaryBinary_binary')
@@ -100,6 +109,17 @@ class test_caching(unittest.TestCase):
             caching.JsonParserException, caching.ImageCache, 'gladtex.cache'
         )
 
+    def test_that_caches_without_options_in_keys_are_replaced(self):
+        write('gladtex.cache', '{"GladTeX__cache__version": "2.0", '
+                '"\\\\tau": {"false": {"path": "eqn000.png", "pos": {}}}}')
+        write('eqn000.png', 'dummy')
+        self.assertRaises(
+            caching.JsonParserException, caching.ImageCache, 'gladtex.cache'
+        )
+        c = caching.ImageCache('gladtex.cache', keep_old_cache=False)
+        self.assertEqual(len(c), 0)
+        self.assertFalse(os.path.exists('eqn000.png'))
+
     def test_that_invalid_style_is_detected(self):
         write('foo.png', 'dummy')
         c = caching.ImageCache('gladtex.cache')
@@ -152,3 +172,54 @@ class test_caching(unittest.TestCase):
         c = caching.ImageCache('gladtex.cache', keep_old_cache=False)
         with self.assertRaises(KeyError):
             c.get_data_for('foo.png', 'False')
+
+    def test_that_options_do_not_count_as_formulas(self):
+        c = caching.ImageCache('gladtex.cache')
+        c.set_options({'dpi': 100})
+        self.assertEqual(len(c), 0)
+
+    def test_that_formulas_are_cached_per_options_and_images_kept(self):
+        write('foo.png', 'dummy')
+        write('bar.png', 'dummy')
+        c = caching.ImageCache('gladtex.cache')
+        c.set_options({'dpi': 100})
+        c.add_formula('\\tau', self.pos, 'foo.png')
+        c.write()
+        c = caching.ImageCache('gladtex.cache')
+        c.set_options({'dpi': 200})
+        self.assertFalse(c.contains('\\tau', False))
+        self.assertTrue(os.path.exists('foo.png'))
+        c.add_formula('\\tau', self.pos, 'bar.png')
+        self.assertEqual(c.get_data_for('\\tau', False)['path'], 'bar.png')
+        c.set_options({'dpi': 100})
+        self.assertEqual(c.get_data_for('\\tau', False)['path'], 'foo.png')
+
+    def test_that_least_recently_used_formulas_are_removed(self):
+        c = caching.ImageCache('gladtex.cache')
+        for name in ('a', 'b', 'c'):
+            write(name + '.png', 'dummy')
+            c.add_formula(name, self.pos, name + '.png')
+        c.write()
+        c = caching.ImageCache('gladtex.cache')
+        c.set_max_entries(2)
+        self.assertTrue(c.contains('a', False))  # a is now used most recently
+        c.write()
+        self.assertEqual(len(c), 2)
+        self.assertFalse(c.contains('b', False))
+        self.assertFalse(os.path.exists('b.png'))
+        self.assertTrue(c.contains('a', False))
+        self.assertTrue(c.contains('c', False))
+
+    def test_that_formulas_used_in_this_run_are_never_removed(self):
+        c = caching.ImageCache('gladtex.cache')
+        c.set_max_entries(1)
+        for name in ('a', 'b'):
+            write(name + '.png', 'dummy')
+            c.add_formula(name, self.pos, name + '.png')
+        c.write()
+        self.assertEqual(len(c), 2)
+        self.assertTrue(os.path.exists('a.png'))
+
+    def test_that_invalid_maximum_number_of_entries_raises(self):
+        c = caching.ImageCache('gladtex.cache')
+        self.assertRaises(ValueError, c.set_max_entries, 0)
@@ -0,0 +1,61 @@
+# pylint: disable=too-many-public-methods,import-error,too-few-public-methods,missing-docstring,unused-variable
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from gleetex import globalcache
+
+
+def write(path, content):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+class test_globalcache(unittest.TestCase):
+    def setUp(self):
+        self.pos = {'height': 8, 'depth': 2, 'width': 666}
+        self.options = {'png': False, 'preamble': None}
+        self.original_directory = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        write('eqn000.svg', 'image')
+        self.cache = globalcache.GlobalCache('global')
+
+    def tearDown(self):
+        os.chdir(self.original_directory)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_that_unknown_formulas_are_not_found(self):
+        self.assertIsNone(self.cache.lookup('\\tau', False, self.options))
+
+    def test_that_stored_formulas_are_found(self):
+        self.cache.store('\\tau', False, self.options, 'eqn000.svg', self.pos)
+        path, pos = self.cache.lookup('\\tau', False, self.options)
+        self.assertEqual(pos, self.pos)
+        self.assertTrue(path.endswith('.svg'))
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read(), 'image')
+
+    def test_that_differently_spaced_formulas_are_the_same(self):
+        self.cache.store('\\tau  \\pi', False, self.options, 'eqn000.svg', self.pos)
+        self.assertIsNotNone(self.cache.lookup('\\tau \\pi ', False, self.options))
+
+    def test_that_displaymath_and_options_are_part_of_the_key(self):
+        self.cache.store('\\tau', False, self.options, 'eqn000.svg', self.pos)
+        self.assertIsNone(self.cache.lookup('\\tau', True, self.options))
+        self.assertIsNone(
+            self.cache.lookup('\\tau', False, {**self.options, 'png': True})
+        )
+
+    def test_that_entries_without_image_are_ignored(self):
+        self.cache.store('\\tau', False, self.options, 'eqn000.svg', self.pos)
+        path, _pos = self.cache.lookup('\\tau', False, self.options)
+        os.remove(path)
+        self.assertIsNone(self.cache.lookup('\\tau', False, self.options))
+
+    def test_that_default_directory_respects_xdg_cache_home(self):
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': 'xdg'}):
+            self.assertEqual(
+                globalcache.default_directory(), os.path.join('xdg', 'gladtex')
+            )
@@ -40,6 +40,15 @@ class HtmlparserTest(unittest.TestCase):
         self.p.feed('</ p></P>')
         self.assertEqual(''.join(self.p.get_data()), '</ p></P>')
 
+    def test_that_last_character_after_formula_is_kept(self):
+        self.p.feed('a<eq>b</eq>c')
+        self.assertEqual(self.p.get_data()[-1], 'c')
+
+    def test_that_no_empty_chunks_are_recorded(self):
+        self.p.feed('<eq>a</eq><eq>b</eq><!-- c -->')
+        self.assertEqual(len(self.p.get_data()), 3)
+        self.assertTrue(all(self.p.get_data()))
+
     def test_entities_are_unchanged(self):
         self.p.feed('&#xa;')
         self.assertEqual(self.p.get_data()[0], '&#xa;')
@@ -55,6 +64,12 @@ class HtmlparserTest(unittest.TestCase):
             'all chunks have to be strings',
         )
 
+    def test_that_possible_formulas_are_recognised_without_parsing(self):
+        self.assertFalse(htmlhandling.contains_formulas('<p>equal</p>'))
+        self.assertFalse(htmlhandling.contains_formulas(b'<p>equal</p>'))
+        self.assertTrue(htmlhandling.contains_formulas('a< EQ>b</EQ>'))
+        self.assertTrue(htmlhandling.contains_formulas(b'a<eq env="x">b</eq>'))
+
     def test_equation_is_detected(self):
         self.p.feed('<eq>foo \\pi</eq>')
         self.assertTrue(isinstance(self.p.get_data()[0], (tuple, list)))
@@ -352,3 +367,18 @@ class HtmlImageTest(unittest.TestCase):
         self.assertTrue('\{' in data)
         self.assertTrue('foo' in data)
         self.assertTrue('\}' in data)
+
+    def test_that_written_html_contains_all_chunks_in_order(self):
+        img = htmlhandling.HtmlImageFormatter('foo.html')
+        chunks = ['<p>%d</p>' % i for i in range(20000)]
+        chunks.insert(
+            5000,
+            {'pos': self.pos, 'formula': '\\tau', 'path': 'foo.png',
+             'displaymath': False},
+        )
+        output = io.StringIO()
+        htmlhandling.write_html(output, chunks, img)
+        data = output.getvalue()
+        self.assertTrue(data.startswith('<p>0</p><p>1</p>'))
+        self.assertTrue(data.endswith('<p>19999</p>'))
+        self.assertTrue('<p>4999</p><img src="foo.png"' in data)
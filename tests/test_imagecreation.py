@@ -1,6 +1,7 @@
 # pylint: disable=too-many-public-methods,import-error,too-few-public-methods,missing-docstring,unused-variable
 import os
 import pprint
+import re
 import shutil
 import tempfile
 import unittest
@@ -62,6 +63,44 @@ def dvipng_mock(cmd, **kwargs):
     )
 
 
+def multipage_mock(pages, fail=False):
+    """Mock dvipng and dvisvgm writing `pages` pages with distinct depths.
+
+    LaTeX calls do nothing. If `fail` is set, the converter raises an error
+    after writing the pages."""
+
+    def call(cmd, **kwargs):
+        if cmd[0] == 'latex':
+            return ''
+        pattern = cmd[cmd.index('-o') + 1]
+        output = []
+        for page in range(1, pages + 1):
+            if cmd[0] == 'dvipng':
+                fn = pattern % page
+                output.append(' depth=%d height=9 width=22' % page)
+            else:
+                # dvisvgm pads the page number to the width given by %Np
+                fn = re.sub(
+                    r'%(\d*)p',
+                    lambda m: '%0*d' % (int(m.group(1) or 0), page),
+                    pattern,
+                )
+                output.append('  width=1pt, height=2pt, depth=%dpt' % page)
+                output.append('  graphic size: 3pt x 4pt')
+            with open(fn, 'w') as f:
+                f.write('page %d' % page)
+        if fail:
+            raise SubprocessError('conversion failed')
+        return '\n'.join(output)
+
+    return call
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
 def touch(files):
     for file in files:
         dirname = os.path.dirname(file)
@@ -103,6 +142,17 @@ class test_imagecreation(unittest.TestCase):
                 'File ' + intermediate_file + ' should not exist.',
             )
 
+    @patch('gleetex.image.proc_call')
+    def test_that_latex_timeout_grows_with_the_number_of_formulas(self, proc_call):
+        i = image.Tex2img(Format.Png)
+        i.create_dvi(doc('a'), 'foo.dvi')
+        single = proc_call.call_args[1]['timeout']
+        document = doc('a')
+        for formula in ('b', 'c'):
+            document.add_equation(formula)
+        i.create_dvi(document, 'foo.dvi')
+        self.assertGreater(proc_call.call_args[1]['timeout'], single)
+
     @patch('gleetex.image.proc_call', latex_error_mock)
     def test_that_intermediate_files_are_removed_when_exception_is_raised(self):
         files = ['foo.log', 'foo.aux', 'foo.tex']
@@ -166,6 +216,71 @@ class test_imagecreation(unittest.TestCase):
         )
         self.assertFalse(os.path.exists(fname('log')))
 
+    def assert_pages_moved_to(self, output_names, dimensions):
+        for page, output_name in enumerate(output_names, 1):
+            self.assertEqual(read(output_name), 'page %d' % page)
+        self.assertEqual(
+            sorted(os.listdir('.')), sorted(os.path.basename(n) for n in output_names)
+        )
+        self.assertEqual(len(dimensions), len(output_names))
+        depths = [d['depth'] for d in dimensions]
+        self.assertEqual(depths, sorted(depths))
+
+    def test_that_svg_pages_are_moved_to_output_names(self):
+        names = ['eqn%03d.svg' % i for i in range(11)]
+        touch(['eqn000.dvi'])
+        with patch('gleetex.image.proc_call', multipage_mock(11)):
+            dimensions = image.create_svgs('eqn000.dvi', names)
+        self.assert_pages_moved_to(names, dimensions)
+
+    def test_that_png_pages_are_moved_to_output_names(self):
+        names = ['eqn007.png', 'eqn002.png', 'eqn009.png']
+        touch(['eqn007.dvi'])
+        with patch('gleetex.image.proc_call', multipage_mock(3)):
+            dimensions = image.create_pngs('eqn007.dvi', names, 115, 'transparent')
+        self.assert_pages_moved_to(names, dimensions)
+        self.assertEqual([d['depth'] for d in dimensions], [1, 2, 3])
+
+    def test_that_dimensions_of_all_svg_pages_are_parsed(self):
+        data = multipage_mock(2)(['dvisvgm', '-o', 'x-%p.svg', 'x.dvi'])
+        self.assertEqual(
+            image.parse_dvisvgm_output(data),
+            [
+                {'depth': 1 * 1.3333333, 'width': 3 * 1.3333333,
+                 'height': 4 * 1.3333333},
+                {'depth': 2 * 1.3333333, 'width': 3 * 1.3333333,
+                 'height': 4 * 1.3333333},
+            ],
+        )
+
+    def test_that_page_count_mismatch_raises_error_and_removes_pages(self):
+        names = ['a.svg', 'b.svg', 'c.svg']
+        with patch('gleetex.image.proc_call', multipage_mock(2)):
+            with self.assertRaises(ValueError):
+                image.create_svgs('a.dvi', names)
+        self.assertEqual(os.listdir('.'), [])
+
+    def test_that_pages_are_removed_if_converter_fails(self):
+        touch(['a.dvi'])
+        for create in (
+            lambda: image.create_svgs('a.dvi', ['a.svg', 'b.svg']),
+            lambda: image.create_pngs('a.dvi', ['a.png', 'b.png'], 115, 'transparent'),
+        ):
+            with patch('gleetex.image.proc_call', multipage_mock(2, fail=True)):
+                with self.assertRaises(SubprocessError):
+                    create()
+            self.assertEqual(os.listdir('.'), [])
+
+    def test_that_batch_conversion_creates_an_image_per_formula(self):
+        document = doc('a')
+        document.add_equation('b')
+        i = image.Tex2img(Format.Svg)
+        with patch('gleetex.image.proc_call', multipage_mock(2)):
+            dimensions = i.convert_batch(document, ['img/eqn000', 'img/eqn001'])
+        self.assertEqual(len(dimensions), 2)
+        self.assertEqual(read(os.path.join('img', 'eqn000.svg')), 'page 1')
+        self.assertEqual(read(os.path.join('img', 'eqn001.svg')), 'page 2')
+
 
 class TestImageResolutionCorrectlyCalculated(unittest.TestCase):
     def test_sizes_are_correctly_calculated(self):
@@ -31,6 +31,29 @@ class test_typesetting(unittest.TestCase):
         doc.set_preamble_string(preamble)
         self.assertTrue(preamble in str(doc))
 
+    def test_that_each_added_formula_gets_a_page_of_its_own(self):
+        doc = LaTeXDocument('a')
+        doc.add_equation('b', True)
+        doc.add_equation('c')
+        doc = str(doc)
+        self.assertEqual(doc.count('\\begin{preview}'), 3)
+        self.assertTrue('\\(a\\)' in doc)
+        self.assertTrue('\\[b\\]' in doc)
+        self.assertTrue('\\(c\\)' in doc)
+
+    def test_that_numbered_formulas_in_one_document_are_independent(self):
+        doc = LaTeXDocument('a')
+        doc.set_latex_environment('equation')
+        doc.add_equation('\\def\\x{1} b')
+        body = str(doc).split('\\begin{document}')[1].split('\\end{document}')[0]
+        pages = body.split('\\begingroup')[1:]
+        self.assertEqual(len(pages), 2)
+        for page in pages:
+            # counter reset before the formula, group closed after it
+            self.assertTrue(page.startswith('\\setcounter{equation}{0}'))
+            self.assertEqual(page.count('\\begin{equation}'), 1)
+            self.assertTrue(page.rstrip().endswith('\\endgroup'))
+
     def test_obviously_wrong_encoding_trigger_exception(self):
         doc = LaTeXDocument('f00')
         self.assertRaises(ValueError, doc.set_encoding, 'latin1:')